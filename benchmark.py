@@ -0,0 +1,387 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+import command
+import config
+import discoverboards
+import hubcontrol
+import sendmail
+import watchdogtest
+
+BENCHMARK_PATH = f"{config.PYTHON_PATH}jsons/benchmarks/"
+# Relative slowdown of the median above which a benchmark counts as a regression
+DEFAULT_THRESHOLD = 0.2
+DEFAULT_ROUNDS = 5
+
+
+class BenchmarkParser(argparse.ArgumentParser):
+    def __init__(self, standalone=False):
+        super().__init__(
+            description="Benchmark hot paths and a full discover and test cycle against stubbed HID, serial and newt")
+        self.standalone = standalone
+        self.add_argument(
+            '-o', '--output',
+            type=str,
+            help=f"file to store the results in (default: {BENCHMARK_PATH}bench_<revision>_<date>.json)",
+            metavar="FILE",
+            dest='output')
+        self.add_argument(
+            '-c', '--compare',
+            type=str,
+            help="baseline results file, exit with an error when a benchmark regressed",
+            metavar="BASELINE",
+            dest='compare')
+        self.add_argument(
+            '-t', '--threshold',
+            type=float,
+            default=DEFAULT_THRESHOLD,
+            help=f"allowed relative slowdown of the median (default: {DEFAULT_THRESHOLD})",
+            metavar="RATIO",
+            dest='threshold')
+        self.add_argument(
+            '-r', '--rounds',
+            type=int,
+            default=DEFAULT_ROUNDS,
+            help=f"number of measured rounds of every benchmark (default: {DEFAULT_ROUNDS})",
+            metavar="COUNT",
+            dest='rounds')
+        self.add_argument(
+            '-k', '--filter',
+            type=str,
+            help="run only benchmarks whose name contains the given text",
+            metavar="TEXT",
+            dest='filter')
+
+    def error(self, message):
+        if not self.standalone:
+            raise Exception(message)
+        self.print_usage(sys.stderr)
+        self.exit(2, f"Error: {message[0].upper() + message[1:] if message else ''}.\n")
+
+    def parse(self, arg_ns=None):
+        return self.parse_args(namespace=arg_ns)
+
+
+class FakePort:
+    def __init__(self, serial_number, index):
+        self.serial_number = serial_number
+        self.device = f"/dev/ttyACM{index}"
+        self.name = f"ttyACM{index}"
+        self.location = f"1-1.{index}:1.0"
+        self.vid = 0x1366
+        self.pid = 0x1015
+        self.manufacturer = "SEGGER"
+        self.product = "J-Link"
+
+
+class FakeBench:
+    # One hub with a board behind every port: powering a port makes its board enumerate and loading
+    # the watchdog app makes it print a few lines followed by a watchdog reset
+    APP_START_DELAY = 0.005
+
+    def __init__(self, board_serials, lines_before_reset=20):
+        self.ports = {number: serial for number, serial in enumerate(board_serials, start=1)}
+        self.powered = set()
+        self.lines_before_reset = lines_before_reset
+        self.app_started_at = None
+
+    def run_cmd(self, cmd, check=True, show_traceback=True):
+        if cmd.startswith("newt load") and cmd.endswith("-watchdog"):
+            self.app_started_at = time.perf_counter() + self.APP_START_DELAY
+        return True, ""
+
+    def comports(self):
+        return [FakePort(self.ports[number], number) for number in sorted(self.powered)]
+
+    def hid_module(self):
+        bench = self
+
+        class Device:
+            def open_path(self, path):
+                pass
+
+            def send_feature_report(self, cmd):
+                for number, state in enumerate(cmd[1:9], start=1):
+                    if state == ord('1') and number in bench.ports:
+                        bench.powered.add(number)
+                    elif state == ord('0'):
+                        bench.powered.discard(number)
+
+            def get_feature_report(self, report_id, length):
+                return [report_id] + [49 if n in bench.powered else 48 for n in range(1, length)]
+
+            def close(self):
+                pass
+
+        return types.SimpleNamespace(
+            enumerate=lambda vid, pid: [{"path": b"bench-hub", "serial_number": "1"}],
+            device=Device)
+
+    def serial_module(self):
+        bench = self
+
+        class SerialException(Exception):
+            pass
+
+        class Serial:
+            def __init__(self, device, rate, timeout=None):
+                bench.app_started_at = None
+                self.is_open = True
+                self.timeout = timeout
+                self.lines = [f"line {i}\n".encode() for i in range(bench.lines_before_reset)]
+                self.lines.append(b"Reset reason: Watchdog\n")
+
+            def running(self):
+                return bench.app_started_at is not None and time.perf_counter() >= bench.app_started_at
+
+            @property
+            def in_waiting(self):
+                return len(self.lines[0]) if self.lines and self.running() else 0
+
+            def read(self, size=1):
+                if not self.lines or not self.running():
+                    time.sleep(min(self.timeout or 0.001, 0.001))
+                    return b""
+                return self.lines.pop(0)
+
+            def close(self):
+                self.is_open = False
+
+        return types.SimpleNamespace(
+            Serial=Serial,
+            serialutil=types.SimpleNamespace(SerialException=SerialException),
+            tools=types.SimpleNamespace(list_ports=types.SimpleNamespace(comports=self.comports)))
+
+
+@contextlib.contextmanager
+def patched(*replacements):
+    saved = [(obj, name, getattr(obj, name)) for obj, name, _ in replacements]
+    for obj, name, value in replacements:
+        setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        for obj, name, value in saved:
+            setattr(obj, name, value)
+
+
+@contextlib.contextmanager
+def stubbed(bench, device_list):
+    serial_module = bench.serial_module()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), patched(
+            (hubcontrol, "hid", bench.hid_module()),
+            (watchdogtest, "serial", serial_module),
+            (discoverboards, "list_ports", serial_module.tools.list_ports),
+            (discoverboards, "load_device_list", lambda: device_list),
+            (discoverboards, "PORT_DELAY", 0),
+            (watchdogtest, "PORT_DELAY", 0),
+            (command, "run_cmd", bench.run_cmd)):
+        yield
+
+
+def measure(func, rounds, number=1):
+    func()
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "Median [s]": statistics.median(times),
+        "Min [s]": min(times),
+        "Mean [s]": statistics.mean(times),
+        "Rounds": rounds,
+        "Number": number,
+    }
+
+
+def serials(count):
+    return [f"{index:024X}" for index in range(count)]
+
+
+def bench_set_cmd_port_set(rounds):
+    hub = hubcontrol.HubController()
+    return measure(lambda: hub.set_cmd_port_set("10x10x10"), rounds, number=10000)
+
+
+def bench_set_cmd_ports(rounds):
+    hub = hubcontrol.HubController()
+    ports = [1, "2", 3, "4", 5, "6", 7, "8", "a"]
+
+    def switch():
+        for port in ports:
+            hub.set_cmd_ports(port, True)
+    return measure(switch, rounds, number=1000)
+
+
+def bench_snapshot_devices(rounds):
+    bench = FakeBench(serials(200))
+    bench.powered.update(bench.ports)
+    with stubbed(bench, {}):
+        return measure(discoverboards.snapshot_devices, rounds, number=100)
+
+
+def bench_detect_new_device(rounds):
+    bench = FakeBench(serials(201))
+    bench.powered.update(bench.ports)
+    with stubbed(bench, {}):
+        after = discoverboards.snapshot_devices()
+    before = dict(list(after.items())[:-1])
+    return measure(lambda: discoverboards.detect_new_device(before, after), rounds, number=1000)
+
+
+def bench_identify_device(rounds):
+    device_list = {serial: {"name": f"board_{index}"} for index, serial in enumerate(serials(10000))}
+    lookups = list(device_list)[::7]
+
+    def identify():
+        for serial in lookups:
+            discoverboards.identify_device(serial, device_list)
+    return measure(identify, rounds, number=10)
+
+
+def bench_watchdog_search(rounds):
+    bench = FakeBench(serials(1), lines_before_reset=10000)
+
+    def search():
+        watchdogtest.done.clear()
+        watchdogtest.stop_event.clear()
+        ser = watchdogtest.serial.Serial("/dev/ttyACM1", watchdogtest.SERIAL_RATE)
+        bench.app_started_at = 0.0
+        watchdogtest.watchdog_search(ser)
+    with stubbed(bench, {}):
+        return measure(search, rounds)
+
+
+def bench_render_report(rounds):
+    results = {
+        "Hub serial": "1",
+        "Watchdog tests": [{
+            "Port": index % 7 + 1,
+            "Board name": f"board_{index}",
+            "Board serial": serial,
+            "Test passed": index % 5 != 0,
+            "Stage": "passed" if index % 5 != 0 else "timeout",
+            "Test time [s]": 42.0,
+        } for index, serial in enumerate(serials(5000))],
+        "Quarantined boards": [],
+    }
+    return measure(lambda: sendmail.render_report(results, "bench.json"), rounds, number=10)
+
+
+def bench_discover_and_test_cycle(rounds):
+    board_serials = serials(discoverboards.NUM_PORTS)
+    bench = FakeBench(board_serials)
+    device_list = {serial: {"name": f"board_{index}"} for index, serial in enumerate(board_serials)}
+    with tempfile.TemporaryDirectory() as tmp, stubbed(bench, device_list):
+        location = f"{tmp}/"
+
+        def cycle():
+            discoverboards.run(device_map_location=location, h_serial="1")
+            watchdogtest.watchdogs_hub(location, discovered=True, health_file=f"{location}board_health.json")
+            for name in os.listdir(tmp):
+                if name.startswith("watchdog_test_") or name == "board_health.json":
+                    os.remove(f"{location}{name}")
+        return measure(cycle, max(1, rounds // 2))
+
+
+BENCHMARKS = {
+    "micro.hub_set_cmd_port_set": bench_set_cmd_port_set,
+    "micro.hub_set_cmd_ports": bench_set_cmd_ports,
+    "micro.snapshot_devices": bench_snapshot_devices,
+    "micro.detect_new_device": bench_detect_new_device,
+    "micro.identify_device": bench_identify_device,
+    "micro.watchdog_search": bench_watchdog_search,
+    "micro.render_report": bench_render_report,
+    "macro.discover_and_test_cycle": bench_discover_and_test_cycle,
+}
+
+
+def revision():
+    success, output = command.run_cmd("git rev-parse --short HEAD", show_traceback=False)
+    return output.strip() if success else "unknown"
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print(f"\n{'Benchmark':<32} {'Baseline [s]':>14} {'Current [s]':>14} {'Change':>8}")
+    for name, current in results["Benchmarks"].items():
+        previous = baseline["Benchmarks"].get(name)
+        if previous is None:
+            print(f"{name:<32} {'-':>14} {current['Median [s]']:>14.6g} {'new':>8}")
+            continue
+        change = current["Median [s]"] / previous["Median [s]"] - 1
+        marker = ""
+        if change > threshold:
+            regressions.append(name)
+            marker = "  REGRESSION"
+        print(f"{name:<32} {previous['Median [s]']:>14.6g} {current['Median [s]']:>14.6g} "
+              f"{change:>+8.1%}{marker}")
+    return regressions
+
+
+def run(standalone=False, output=None, baseline_file=None, threshold=DEFAULT_THRESHOLD,
+        rounds=DEFAULT_ROUNDS, name_filter=None):
+    parser = BenchmarkParser(standalone=standalone)
+    if standalone:
+        args = parser.parse()
+        output = args.output
+        baseline_file = args.compare
+        threshold = args.threshold
+        rounds = args.rounds
+        name_filter = args.filter
+
+    baseline = None
+    if baseline_file:
+        try:
+            with open(baseline_file, "r") as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read baseline {baseline_file}: {e}")
+
+    now = datetime.datetime.now()
+    results = {
+        "Revision": revision(),
+        "Date": now.isoformat(timespec='seconds'),
+        "Python": platform.python_version(),
+        "Benchmarks": {},
+    }
+    for name, benchmark in BENCHMARKS.items():
+        if name_filter and name_filter not in name:
+            continue
+        stats = benchmark(rounds)
+        results["Benchmarks"][name] = stats
+        print(f"{name:<32} median {stats['Median [s]']:.6g} s  min {stats['Min [s]']:.6g} s")
+
+    output = output or f"{BENCHMARK_PATH}bench_{results['Revision']}_{now.strftime('%Y-%m-%d_%H-%M')}.json"
+    output_file = Path(output)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_file, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    regressions = compare(results, baseline, threshold) if baseline else []
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) regressed by more than {threshold:.0%}.")
+        if standalone:
+            sys.exit(1)
+    return regressions
+
+
+def main():
+    run(standalone=True)
+
+
+if __name__ == "__main__":
+    main()
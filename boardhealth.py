@@ -0,0 +1,114 @@
+import datetime
+import json
+from pathlib import Path
+
+import config
+
+HEALTH_FILE = f"{config.PYTHON_PATH}jsons/board_health.json"
+# Number of recent outcomes kept for every board
+HISTORY_LENGTH = 10
+# Consecutive infrastructure failures after which a board is quarantined
+QUARANTINE_THRESHOLD = 3
+# Days between cheap probes of a quarantined board
+PROBE_INTERVAL_DAYS = 7
+
+STAGE_PASSED = "passed"
+STAGE_NOT_ENUMERATED = "not_enumerated"
+STAGE_BUILD_FAILED = "build_failed"
+STAGE_LOAD_FAILED = "load_failed"
+STAGE_SERIAL_ERROR = "serial_error"
+STAGE_NO_OUTPUT = "no_output"
+STAGE_TIMEOUT = "timeout"
+STAGE_FAILED = "failed"
+
+# Stages that point at dead hardware or a wedged debugger rather than at the tested app.
+# A build failure is shared by all boards of the same BSP, so it never quarantines a board.
+# No output comes after a successful load, so it may as well be a regression of the tested code.
+INFRASTRUCTURE_STAGES = (
+    STAGE_NOT_ENUMERATED,
+    STAGE_LOAD_FAILED,
+    STAGE_SERIAL_ERROR,
+)
+
+
+class BoardHealth:
+    def __init__(self, filename=HEALTH_FILE):
+        self.filename = filename
+        self.boards = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                self.boards = json.load(f)
+        except FileNotFoundError:
+            self.boards = {}
+
+    def save(self):
+        output_file = Path(self.filename)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file, "w") as f:
+            json.dump(self.boards, f, indent=2)
+
+    def board(self, board_serial, board_name=None):
+        entry = self.boards.setdefault(board_serial, {
+            "Board name": board_name,
+            "Infrastructure failures": 0,
+            "Quarantined since": None,
+            "Last probe": None,
+            "History": [],
+        })
+        if board_name:
+            entry["Board name"] = board_name
+        return entry
+
+    def record(self, board_serial, board_name, stage, now=None):
+        now = now or datetime.datetime.now()
+        entry = self.board(board_serial, board_name)
+        entry["History"].append({"Date": now.isoformat(timespec='seconds'), "Stage": stage})
+        del entry["History"][:-HISTORY_LENGTH]
+
+        if stage in INFRASTRUCTURE_STAGES:
+            entry["Infrastructure failures"] += 1
+        elif stage != STAGE_BUILD_FAILED:
+            entry["Infrastructure failures"] = 0
+
+        if entry["Infrastructure failures"] >= QUARANTINE_THRESHOLD:
+            if entry["Quarantined since"] is None:
+                entry["Quarantined since"] = now.isoformat(timespec='seconds')
+                entry["Last probe"] = now.isoformat(timespec='seconds')
+                print(f"Board {board_name} ({board_serial}) quarantined after "
+                      f"{entry['Infrastructure failures']} infrastructure failures.")
+        elif entry["Quarantined since"] is not None:
+            self.release(board_serial)
+
+    def release(self, board_serial):
+        entry = self.boards[board_serial]
+        print(f"Board {entry['Board name']} ({board_serial}) released from quarantine.")
+        entry["Infrastructure failures"] = 0
+        entry["Quarantined since"] = None
+        entry["Last probe"] = None
+
+    def is_quarantined(self, board_serial):
+        entry = self.boards.get(board_serial)
+        return entry is not None and entry["Quarantined since"] is not None
+
+    def probe_due(self, board_serial, now=None):
+        now = now or datetime.datetime.now()
+        last_probe = self.boards[board_serial]["Last probe"]
+        if last_probe is None:
+            return True
+        elapsed = now - datetime.datetime.fromisoformat(last_probe)
+        return elapsed >= datetime.timedelta(days=PROBE_INTERVAL_DAYS)
+
+    def record_probe(self, board_serial, enumerated, now=None):
+        now = now or datetime.datetime.now()
+        entry = self.boards[board_serial]
+        entry["Last probe"] = now.isoformat(timespec='seconds')
+        if enumerated:
+            self.release(board_serial)
+            # On probation: a single infrastructure failure quarantines the board again
+            entry["Infrastructure failures"] = QUARANTINE_THRESHOLD - 1
+
+    def quarantined(self):
+        return {s: e for s, e in self.boards.items() if e["Quarantined since"] is not None}
@@ -0,0 +1,72 @@
+import argparse
+import importlib
+import sys
+
+# Subcommands are dispatched to the main() of their module, which is imported only when the subcommand
+# is used, so e.g. "hub" never pays for serial, newt helpers or the scheduler.
+COMMANDS = {
+    "hub": ("hubcontrol", "control power state of ports on a USB hub"),
+    "discover": ("discoverboards", "discover devices in the hub"),
+    "build": ("targetscripts", "create and build boot and test case targets for every BSP"),
+    "test": ("watchdogtest", "run watchdog test on devices in the hub"),
+    "report": ("sendmail", "send the email report of a test result file"),
+    "dashboard": ("dashboard", "add test results to the static HTML dashboard"),
+    "schedule": ("scheduledtest", "run the daily test and report on schedule"),
+    "coordinator": ("farmcoordinator", "distribute tests to station workers"),
+    "station": ("farmstation", "run tests distributed by the coordinator"),
+    "replay": ("serialsession", "replay recorded serial sessions and check their verdicts"),
+    "bench": ("benchmark", "benchmark hot paths and a full test cycle against stubbed hardware"),
+}
+
+
+class BoardTestsParser(argparse.ArgumentParser):
+    def __init__(self, standalone=False):
+        super().__init__(
+            description="Board tests command line",
+            formatter_class=argparse.RawDescriptionHelpFormatter,
+            epilog="commands:\n" + "\n".join(f"  {name:<12} {help_text}"
+                                              for name, (_, help_text) in COMMANDS.items()) +
+                   "\n\nRun a command with -h to see its own options.")
+        self.standalone = standalone
+        self.add_argument(
+            'command',
+            choices=COMMANDS,
+            help="command to run",
+            metavar="COMMAND")
+        self.add_argument(
+            'args',
+            nargs=argparse.REMAINDER,
+            help=argparse.SUPPRESS)
+
+    def error(self, message):
+        if not self.standalone:
+            raise Exception(message)
+        self.print_usage(sys.stderr)
+        self.exit(2, f"Error: {message[0].upper() + message[1:] if message else ''}.\n")
+
+    def parse(self, arg_ns=None):
+        return self.parse_args(namespace=arg_ns)
+
+
+def run(standalone=False, command=None, args=()):
+    parser = BoardTestsParser(standalone=standalone)
+    if standalone:
+        parsed = parser.parse()
+        command = parsed.command
+        args = parsed.args
+    elif command not in COMMANDS:
+        parser.error(f"unknown command {command}")
+
+    module_name, _ = COMMANDS[command]
+    module = importlib.import_module(module_name)
+    # Every tool parses sys.argv on its own, so hand it the remaining arguments
+    sys.argv = [f"{parser.prog} {command}", *args]
+    module.main()
+
+
+def main():
+    run(standalone=True)
+
+
+if __name__ == "__main__":
+    main()
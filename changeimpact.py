@@ -0,0 +1,183 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+import command
+import config
+import targetscripts
+
+IMPACT_FILE = f"{config.PYTHON_PATH}jsons/impact_state.json"
+REPOS_PATH = f"{config.TARGET_PATH}repos/"
+# Days after which every board is tested again, whether its inputs changed or not
+FULL_SWEEP_DAYS = 7
+# Dependencies of a BSP which are followed when collecting the inputs of a board: packages of the core
+# repository under these paths (MCU, HAL, drivers) and everything in other repositories (vendor HALs, SDKs)
+CORE_REPO = "apache-mynewt-core"
+FOLLOWED_PACKAGES = ("hw/",)
+
+PACKAGE_PATTERN = re.compile(r'["\']?@([\w.-]+)(?:/([\w./-]+?))?/?["\']?\s*$')
+
+
+def package_path(package):
+    # "@repo/path" lives in repos/repo/path, anything else is a package of the project itself
+    if package.startswith('@'):
+        repo, _, path = package[1:].partition('/')
+        return f"{REPOS_PATH}{repo}/{path}", repo
+    return f"{config.TARGET_PATH}{package}", None
+
+
+def package_deps(path):
+    deps = []
+    try:
+        with open(f"{path}/pkg.yml", "r") as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line.startswith('-'):
+                    continue
+                match = PACKAGE_PATTERN.match(line[1:].strip())
+                if match:
+                    deps.append(f"@{match.group(1)}/{match.group(2)}" if match.group(2) else f"@{match.group(1)}")
+    except FileNotFoundError:
+        pass
+    return deps
+
+
+def followed(package):
+    repo, _, path = package[1:].partition('/')
+    return repo != CORE_REPO or path.startswith(FOLLOWED_PACKAGES)
+
+
+def hash_directory(path):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode('utf-8') + b"\0")
+            with open(file_path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def repo_revision(repo):
+    success, output = command.run_cmd(f"git -C {REPOS_PATH}{repo} rev-parse HEAD", show_traceback=False)
+    return output.strip() if success else None
+
+
+class ImpactAnalyzer:
+    def __init__(self, app_names):
+        self.app_names = app_names
+        # Boards share MCU and HAL packages, so every directory is hashed once per run
+        self.hashes = {}
+        self.revisions = {}
+
+    def package_hash(self, package):
+        if package not in self.hashes:
+            path, repo = package_path(package)
+            self.hashes[package] = hash_directory(path) if os.path.isdir(path) else None
+            if repo and repo not in self.revisions:
+                self.revisions[repo] = repo_revision(repo)
+        return self.hashes[package]
+
+    def board_packages(self, board_name):
+        packages = [targetscripts.bsp_package(board_name)]
+        packages += [targetscripts.app_package(app_name) for app_name in self.app_names]
+        pending = [targetscripts.bsp_package(board_name)]
+        while pending:
+            path, _ = package_path(pending.pop())
+            for dep in package_deps(path):
+                if dep not in packages and followed(dep):
+                    packages.append(dep)
+                    pending.append(dep)
+        return sorted(packages)
+
+    def inputs(self, board_name):
+        hashes = {package: self.package_hash(package) for package in self.board_packages(board_name)}
+        repos = sorted({package[1:].partition('/')[0] for package in hashes if package.startswith('@')})
+        fingerprint = hashlib.sha256(json.dumps(hashes, sort_keys=True).encode('utf-8')).hexdigest()
+        return {
+            "Fingerprint": fingerprint,
+            "Inputs": hashes,
+            "Revisions": {repo: self.revisions.get(repo) for repo in repos},
+        }
+
+
+class ImpactState:
+    def __init__(self, app_names, filename=IMPACT_FILE):
+        self.filename = filename
+        self.analyzer = ImpactAnalyzer(app_names)
+        self.state = {"Last full sweep": None, "Boards": {}}
+        self.full_sweep = False
+        self.inputs = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        output_file = Path(self.filename)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_file, "w") as f:
+            json.dump(self.state, f, indent=2)
+
+    def full_sweep_due(self, now):
+        last = self.state["Last full sweep"]
+        if last is None:
+            return True
+        return now - datetime.datetime.fromisoformat(last) >= datetime.timedelta(days=FULL_SWEEP_DAYS)
+
+    def select(self, ports, now=None):
+        # Returns the ports to test and entries for boards skipped because nothing they depend on changed
+        now = now or datetime.datetime.now()
+        self.full_sweep = self.full_sweep_due(now)
+        if self.full_sweep:
+            print(f"Full sweep: last one is older than {FULL_SWEEP_DAYS} days.")
+
+        selected = []
+        skipped = []
+        for port in ports:
+            board_name = port["Name"]
+            board_serial = port["Serial_number"]
+            if board_name not in self.inputs:
+                self.inputs[board_name] = self.analyzer.inputs(board_name)
+            inputs = self.inputs[board_name]
+            previous = self.state["Boards"].get(board_serial)
+
+            if self.full_sweep or previous is None or not previous["Passed"]:
+                selected.append(port)
+            elif previous["Fingerprint"] != inputs["Fingerprint"]:
+                changed = [p for p, h in inputs["Inputs"].items() if previous["Inputs"].get(p) != h]
+                print(f"Board {board_name} ({board_serial}) selected, changed inputs: {', '.join(changed)}")
+                selected.append(port)
+            else:
+                skipped.append({
+                    "Port": port["Port"],
+                    "Board name": board_name,
+                    "Board serial": board_serial,
+                    "Last tested": previous["Tested"],
+                })
+        print(f"Selected {len(selected)} of {len(ports)} boards, {len(skipped)} unchanged.")
+        return selected, skipped
+
+    def record(self, board_name, board_serial, passed, now=None):
+        now = now or datetime.datetime.now()
+        inputs = self.inputs.get(board_name) or self.analyzer.inputs(board_name)
+        self.state["Boards"][board_serial] = {
+            "Board name": board_name,
+            "Passed": passed,
+            "Tested": now.isoformat(timespec='seconds'),
+            **inputs,
+        }
+
+    def finish(self, now=None):
+        now = now or datetime.datetime.now()
+        if self.full_sweep:
+            self.state["Last full sweep"] = now.isoformat(timespec='seconds')
+        self.save()
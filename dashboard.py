@@ -0,0 +1,270 @@
+import argparse
+import datetime
+import glob
+import html
+import json
+import os
+import re
+import sys
+from pathlib import Path
+
+import config
+import sendmail
+
+DASHBOARD_PATH = f"{config.PYTHON_PATH}dashboard/"
+RESULT_PATTERN = f"{config.PYTHON_PATH}jsons/watchdog_test_*.json"
+# Rows on one page of a board history, full pages are never rendered again
+HISTORY_PAGE_SIZE = 100
+# Runs listed on the index page
+RECENT_RUNS = 30
+
+DATE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})_(\d{2})-(\d{2})")
+STATUS_STYLE = {
+    "pass": ("✅", "green"),
+    "fail": ("❌", "red"),
+    "quarantined": ("⛔", "gray"),
+}
+
+
+class DashboardParser(argparse.ArgumentParser):
+    def __init__(self, standalone=False):
+        super().__init__(
+            description="Add test results to a static HTML dashboard, serve it e.g. with "
+                        "'python -m http.server -d DIR'")
+        self.standalone = standalone
+        self.add_argument(
+            'files',
+            nargs='*',
+            help="result files to add (default: newest watchdog_test_*.json)",
+            metavar="FILE")
+        self.add_argument(
+            '-o', '--output',
+            type=str,
+            default=DASHBOARD_PATH,
+            help=f"dashboard directory (default: {DASHBOARD_PATH})",
+            metavar="DIR",
+            dest='output')
+        self.add_argument(
+            '-a', '--all',
+            action='store_true',
+            help="add every watchdog_test_*.json not yet in the dashboard, oldest first",
+            dest='all')
+
+    def error(self, message):
+        if not self.standalone:
+            raise Exception(message)
+        self.print_usage(sys.stderr)
+        self.exit(2, f"Error: {message[0].upper() + message[1:] if message else ''}.\n")
+
+    def parse(self, arg_ns=None):
+        return self.parse_args(namespace=arg_ns)
+
+
+def run_date(result_file):
+    match = DATE_PATTERN.search(os.path.basename(result_file))
+    if match:
+        return datetime.datetime.strptime(f"{match.group(1)} {match.group(2)}:{match.group(3)}", "%Y-%m-%d %H:%M")
+    return datetime.datetime.fromtimestamp(os.path.getmtime(result_file))
+
+
+def page(title, body, root="."):
+    return f"""<!DOCTYPE html>
+<html>
+  <head>
+    <meta charset="utf-8">
+    <title>{html.escape(title)}</title>
+  </head>
+  <body>
+    <p><a href="{root}/index.html">Dashboard</a></p>
+    <h2 style="color: steelblue;">{html.escape(title)}</h2>
+    {body}
+  </body>
+</html>
+"""
+
+
+def table(headers, rows, caption=None):
+    caption = f"<caption>{html.escape(caption)}</caption>" if caption else ""
+    header = "".join(f"<th>{html.escape(h)}</th>" for h in headers)
+    body = "".join(f"<tr>{''.join(f'<td>{cell}</td>' for cell in row)}</tr>" for row in rows)
+    return (f'<table border="1" cellspacing="0" cellpadding="5" style="border-collapse: collapse;">'
+            f"{caption}<tr>{header}</tr>{body}</table>")
+
+
+def status_cell(status):
+    icon, color = STATUS_STYLE[status]
+    return f"<span style='color:{color};' title='{status}'>{icon}</span>"
+
+
+class Dashboard:
+    def __init__(self, output=DASHBOARD_PATH):
+        self.output = Path(output)
+        self.data = self.output / "data"
+        self.index = self.read_json(self.data / "index.json", {"Runs": [], "Months": [], "Boards": {}})
+
+    @staticmethod
+    def read_json(path, default):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return default
+
+    @staticmethod
+    def write(path, content):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def write_json(self, path, data):
+        self.write(path, json.dumps(data, indent=1))
+
+    def contains(self, run_id):
+        return (self.output / "runs" / f"{run_id}.html").exists()
+
+    def add_result(self, result_file):
+        # Renders only the pages the run touches: its own page, the current history page of each of its
+        # boards, the matrix of its month and the index, so the cost does not grow with the history
+        run_id = Path(result_file).stem
+        if self.contains(run_id):
+            print(f"{run_id} is already in the dashboard.")
+            return False
+        with open(result_file, "r") as f:
+            results = json.load(f)
+        date = run_date(result_file)
+
+        entries = [(test["Board serial"], test["Board name"], test["Port"],
+                    "pass" if test["Test passed"] else "fail", test.get("Stage", ""))
+                   for test in results.get("Watchdog tests", [])]
+        entries += [(board["Board serial"], board["Board name"], board["Port"], "quarantined", "")
+                    for board in results.get("Quarantined boards", [])]
+
+        self.write(self.output / "runs" / f"{run_id}.html",
+                   page(f"Test Report {run_id}",
+                        sendmail.render_report_content(results, os.path.basename(result_file)), root=".."))
+        for board_serial, board_name, port, status, stage in entries:
+            self.add_board_row(board_serial, board_name, {
+                "Date": date.isoformat(sep=' ', timespec='minutes'),
+                "Run": run_id,
+                "Hub": results.get("Hub serial"),
+                "Port": port,
+                "Status": status,
+                "Stage": stage,
+            })
+        self.update_matrix(date, entries)
+
+        passed = sum(1 for entry in entries if entry[3] == "pass")
+        self.index["Runs"].insert(0, {
+            "Run": run_id,
+            "Date": date.isoformat(sep=' ', timespec='minutes'),
+            "Hub": results.get("Hub serial"),
+            "Passed": passed,
+            "Boards": len(entries),
+        })
+        self.index["Runs"].sort(key=lambda r: r["Date"], reverse=True)
+        del self.index["Runs"][RECENT_RUNS:]
+        self.render_index()
+        self.write_json(self.data / "index.json", self.index)
+        print(f"Added {run_id} to the dashboard in {self.output}")
+        return True
+
+    def add_board_row(self, board_serial, board_name, row):
+        board = self.index["Boards"].setdefault(board_serial, {"Board name": board_name, "Pages": 0})
+        board["Board name"] = board_name
+        board["Last status"] = row["Status"]
+        board["Last run"] = row["Date"]
+
+        data_path = self.data / "boards" / f"{board_serial}.json"
+        rows = self.read_json(data_path, [])
+        if len(rows) >= HISTORY_PAGE_SIZE:
+            # The current page is full: freeze it under its number and start a new one
+            board["Pages"] += 1
+            self.render_board_page(board_serial, board, rows, self.output / "boards" /
+                                   f"{board_serial}-{board['Pages']}.html", frozen=True)
+            rows = []
+        rows.insert(0, row)
+        self.write_json(data_path, rows)
+        self.render_board_page(board_serial, board, rows, self.output / "boards" / f"{board_serial}.html")
+
+    def render_board_page(self, board_serial, board, rows, path, frozen=False):
+        body = table(["Date", "Hub", "Port", "Result", "Stage", "Run"], [
+            [html.escape(r["Date"]), html.escape(str(r["Hub"])), r["Port"], status_cell(r["Status"]),
+             html.escape(r["Stage"] or ""), f"<a href='../runs/{r['Run']}.html'>{html.escape(r['Run'])}</a>"]
+            for r in rows])
+        older = [f"<a href='{board_serial}-{number}.html'>{number}</a>" for number in range(board["Pages"], 0, -1)]
+        if older and not frozen:
+            body += f"<p>Older results: {', '.join(older)}</p>"
+        if frozen:
+            body += f"<p><a href='{board_serial}.html'>Latest results</a></p>"
+        self.write(path, page(f"{board['Board name']} ({board_serial})", body, root=".."))
+
+    def update_matrix(self, date, entries):
+        month = date.strftime("%Y-%m")
+        day = str(date.day)
+        data_path = self.data / "matrix" / f"{month}.json"
+        matrix = self.read_json(data_path, {})
+        for board_serial, board_name, port, status, stage in entries:
+            row = matrix.setdefault(board_serial, {"Board name": board_name, "Days": {}})
+            row["Days"][day] = status
+        self.write_json(data_path, matrix)
+        if month not in self.index["Months"]:
+            self.index["Months"].append(month)
+            self.index["Months"].sort(reverse=True)
+
+        first = datetime.date(date.year, date.month, 1)
+        days = ((first + datetime.timedelta(days=32)).replace(day=1) - first).days
+        rows = [[f"<a href='../boards/{serial}.html'>{html.escape(row['Board name'])}</a>",
+                 *(status_cell(row["Days"][str(d)]) if str(d) in row["Days"] else ""
+                   for d in range(1, days + 1))]
+                for serial, row in sorted(matrix.items(), key=lambda item: item[1]["Board name"])]
+        body = table(["Board", *(str(d) for d in range(1, days + 1))], rows)
+        self.write(self.output / "matrix" / f"{month}.html", page(f"Results {month}", body, root=".."))
+
+    def render_index(self):
+        runs = table(["Date", "Hub", "Passed", "Run"], [
+            [html.escape(r["Date"]), html.escape(str(r["Hub"])), f"{r['Passed']}/{r['Boards']}",
+             f"<a href='runs/{r['Run']}.html'>{html.escape(r['Run'])}</a>"]
+            for r in self.index["Runs"]], caption="Recent runs")
+        boards = table(["Board", "Serial", "Last result", "Last run"], [
+            [html.escape(b["Board name"]), f"<a href='boards/{serial}.html'>{html.escape(serial)}</a>",
+             status_cell(b["Last status"]), html.escape(b["Last run"])]
+            for serial, b in sorted(self.index["Boards"].items(), key=lambda item: item[1]["Board name"])],
+            caption="Boards")
+        months = ", ".join(f"<a href='matrix/{m}.html'>{m}</a>" for m in self.index["Months"])
+        body = f"<p>Board × day results: {months}</p>{runs}<br>{boards}"
+        self.write(self.output / "index.html", page("Test Dashboard", body))
+
+
+def run(standalone=False, result_files=(), output=DASHBOARD_PATH, add_all=False):
+    parser = DashboardParser(standalone=standalone)
+    if standalone:
+        args = parser.parse()
+        result_files = args.files
+        output = args.output
+        add_all = args.all
+
+    dashboard = Dashboard(output)
+    if add_all:
+        result_files = sorted(glob.glob(RESULT_PATTERN), key=run_date)
+        result_files = [f for f in result_files if not dashboard.contains(Path(f).stem)]
+    elif not result_files:
+        newest = sendmail.newest_result()
+        if newest is None:
+            parser.error("no result file to add")
+        result_files = [newest]
+
+    for result_file in result_files:
+        try:
+            dashboard.add_result(result_file)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Skipped {result_file}: {e}")
+
+
+def main():
+    run(standalone=True)
+
+
+if __name__ == "__main__":
+    main()
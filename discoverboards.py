@@ -74,7 +74,10 @@ def detect_new_device(before, after):
     return {s: after[s] for s in after if s not in before}
 
 
-def probe_port(port, hubcontroller=hubcontrol.HubController()):
+def probe_port(port, hubcontroller=None):
+    if hubcontroller is None:
+        hubcontroller = hubcontrol.HubController()
+        hubcontroller.find_hub()
     print(f"\nProbing port {port}")
     before = snapshot_devices()
 
@@ -97,7 +100,10 @@ def probe_port(port, hubcontroller=hubcontrol.HubController()):
     return new_devices
 
 
-def map_ports(hubcontroller=hubcontrol.HubController()):
+def map_ports(hubcontroller=None):
+    if hubcontroller is None:
+        hubcontroller = hubcontrol.HubController()
+        hubcontroller.find_hub()
     print(f"Probing ports on hub {hubcontroller.serial}")
     hubcontroller.set_power('a', False)
     device_list = load_device_list()
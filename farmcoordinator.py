@@ -0,0 +1,276 @@
+import argparse
+import os
+import socketserver
+import sys
+import threading
+import time
+
+import config
+import farmprotocol
+import targetscripts
+import testcases
+import watchdogtest
+
+BIN_TARGETS_PATH = f"{config.TARGET_PATH}bin/targets/"
+# Seconds a disconnected station has to come back before its remaining jobs are dropped
+RECONNECT_TIMEOUT = 300
+
+
+class CoordinatorParser(argparse.ArgumentParser):
+    def __init__(self, standalone=False):
+        super().__init__(
+            description="Distribute tests of boards to station workers and collect the results")
+        self.standalone = standalone
+        self.add_argument(
+            '-a', '--address',
+            type=str,
+            default=farmprotocol.DEFAULT_ADDRESS,
+            help=f"HOST:PORT or Unix socket path to listen on (default: {farmprotocol.DEFAULT_ADDRESS})",
+            metavar="ADDRESS",
+            dest='address')
+        self.add_argument(
+            '-n', '--stations',
+            type=int,
+            default=1,
+            help="number of stations expected to join the run (default: 1)",
+            metavar="COUNT",
+            dest='stations')
+        self.add_argument(
+            '-b', '--build',
+            action='store_true',
+            help="build targets once on this host and ship the images to stations",
+            dest='build')
+        self.add_argument(
+            '-t', '--test-cases',
+            type=str,
+            help="comma separated test cases run on every board within one power-on "
+                 f"(default: {','.join(watchdogtest.DEFAULT_TEST_CASES)}), "
+                 f"available: {','.join(testcases.TEST_CASES)}",
+            metavar="CASES",
+            dest='test_cases')
+
+    def error(self, message):
+        if not self.standalone:
+            raise Exception(message)
+        self.print_usage(sys.stderr)
+        self.exit(2, f"Error: {message[0].upper() + message[1:] if message else ''}.\n")
+
+    def parse(self, arg_ns=None):
+        return self.parse_args(namespace=arg_ns)
+
+
+class Coordinator:
+    def __init__(self, expected_stations=1, build=False, test_cases=None):
+        self.expected_stations = expected_stations
+        self.build = build
+        # A job runs all test cases on one board, so the bootloader is loaded once per board
+        self.test_cases = test_cases or testcases.get_test_cases(watchdogtest.DEFAULT_TEST_CASES)
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+        self.build_lock = threading.Lock()
+        self.builds = {}
+        self.stations = {}
+        self.next_job_id = 1
+
+    def register(self, station, device_map):
+        with self.lock:
+            if station in self.stations:
+                print(f"Station {station} reconnected.")
+                self.stations[station]["Disconnected at"] = None
+                return
+            jobs = []
+            for port in device_map["Ports"]:
+                jobs.append({
+                    "Id": self.next_job_id,
+                    "Station": station,
+                    "Test cases": [test_case.name for test_case in self.test_cases],
+                    "Port": port,
+                })
+                self.next_job_id += 1
+            self.stations[station] = {
+                "Hub serial": device_map["Hub serial"],
+                "Queue": jobs,
+                "Running": {},
+                "Results": [],
+                "Quarantined": [],
+                "Untested": [],
+                "Disconnected at": None,
+            }
+            print(f"Station {station} joined with {len(jobs)} jobs for hub {device_map['Hub serial']}.")
+            # The run may be complete already, e.g. when the last station has no boards
+            self.finished.notify_all()
+
+    def take_job(self, station):
+        with self.lock:
+            queue = self.stations[station]["Queue"]
+            if not queue:
+                return None
+            job = queue.pop(0)
+            self.stations[station]["Running"][job["Id"]] = job
+        if self.build:
+            job = dict(job, Build=self.build_images(job["Port"]["Name"]))
+        return job
+
+    def requeue(self, station):
+        # Jobs of a station which disconnected mid-test go back to the front of its queue,
+        # they are dropped when the station does not reconnect within RECONNECT_TIMEOUT
+        with self.lock:
+            entry = self.stations.get(station)
+            if entry is None:
+                return
+            entry["Disconnected at"] = time.monotonic()
+            if entry["Running"]:
+                entry["Queue"][:0] = entry["Running"].values()
+                entry["Running"].clear()
+            self.finished.notify_all()
+
+    def drop_lost_stations(self):
+        # Called with the lock held
+        now = time.monotonic()
+        for station, entry in self.stations.items():
+            disconnected_at = entry["Disconnected at"]
+            if entry["Queue"] and disconnected_at is not None and now - disconnected_at > RECONNECT_TIMEOUT:
+                print(f"Station {station} did not reconnect within {RECONNECT_TIMEOUT} s, "
+                      f"dropped {len(entry['Queue'])} jobs.")
+                entry["Untested"] += [job["Port"] for job in entry["Queue"]]
+                entry["Queue"].clear()
+
+    def complete_job(self, station, job_id, result, quarantined):
+        with self.lock:
+            entry = self.stations[station]
+            job = entry["Running"].pop(job_id, None)
+            if job is None:
+                return
+            if result is not None:
+                entry["Results"].append(result)
+                status = "passed" if result["Test passed"] else f"failed ({result.get('Stage')})"
+                print(f"[{station}] {', '.join(job['Test cases'])} on port {result['Port']} "
+                      f"({result['Board name']}): {status}")
+            if quarantined is not None:
+                entry["Quarantined"].append(quarantined)
+                print(f"[{station}] port {quarantined['Port']} ({quarantined['Board name']}): quarantined")
+            self.finished.notify_all()
+
+    def station_finished(self, station):
+        with self.lock:
+            entry = self.stations[station]
+            return not entry["Queue"] and not entry["Running"]
+
+    def is_finished(self):
+        if len(self.stations) < self.expected_stations:
+            return False
+        return all(not e["Queue"] and not e["Running"] for e in self.stations.values())
+
+    def build_images(self, board_name):
+        # newt does not support concurrent builds within one project, so builds are serialised
+        images = {}
+        with self.build_lock:
+            for app in watchdogtest.session_apps(self.test_cases):
+                target_name = targetscripts.create_target_name(board_name, app)
+                if target_name not in self.builds:
+                    success = targetscripts.full_create_target(target_name, board_name, app)
+                    path = f"{BIN_TARGETS_PATH}{target_name}"
+                    self.builds[target_name] = farmprotocol.pack_directory(path) \
+                        if success and os.path.isdir(path) else None
+                images[target_name] = self.builds[target_name]
+        return images
+
+    def wait(self):
+        with self.lock:
+            while not self.finished.wait_for(self.is_finished, timeout=farmprotocol.POLL_DELAY):
+                self.drop_lost_stations()
+
+    def results(self):
+        return {
+            station: {
+                "Hub serial": entry["Hub serial"],
+                "Station": station,
+                "Watchdog tests": entry["Results"],
+                "Quarantined boards": entry["Quarantined"],
+                "Untested boards": entry["Untested"],
+            }
+            for station, entry in self.stations.items()
+        }
+
+
+class StationHandler(socketserver.StreamRequestHandler):
+    coordinator = None
+
+    def handle(self):
+        station = None
+        try:
+            while True:
+                message = farmprotocol.read_message(self.rfile)
+                if message is None:
+                    break
+                kind = message.get("type")
+                if kind == "hello":
+                    station = message["station"]
+                    self.coordinator.register(station, message["device_map"])
+                    farmprotocol.send_message(self.wfile, {"type": "welcome"})
+                elif station is None:
+                    farmprotocol.send_message(self.wfile, {"type": "error", "message": "hello expected"})
+                elif kind == "get_job":
+                    job = self.coordinator.take_job(station)
+                    if job is not None:
+                        farmprotocol.send_message(self.wfile, {"type": "job", "job": job})
+                    elif self.coordinator.station_finished(station):
+                        farmprotocol.send_message(self.wfile, {"type": "done"})
+                    else:
+                        farmprotocol.send_message(self.wfile, {"type": "wait", "delay": farmprotocol.POLL_DELAY})
+                elif kind == "result":
+                    self.coordinator.complete_job(station, message["job_id"],
+                                                  message.get("result"), message.get("quarantined"))
+                else:
+                    farmprotocol.send_message(self.wfile, {"type": "error", "message": f"unknown type {kind}"})
+        finally:
+            if station is not None:
+                self.coordinator.requeue(station)
+
+
+def run(standalone=False, address=farmprotocol.DEFAULT_ADDRESS, stations=1, build=False,
+        result_location=f"{config.PYTHON_PATH}jsons/", test_case_names=watchdogtest.DEFAULT_TEST_CASES):
+    program_start = time.perf_counter()
+    parser = CoordinatorParser(standalone=standalone)
+    if standalone:
+        args = parser.parse()
+        address = args.address
+        stations = args.stations
+        build = args.build
+        if args.test_cases:
+            test_case_names = testcases.parse_names(args.test_cases)
+
+    try:
+        test_cases = testcases.get_test_cases(test_case_names)
+    except Exception as e:
+        parser.error(str(e))
+    coordinator = Coordinator(expected_stations=stations, build=build, test_cases=test_cases)
+    handler = type("Handler", (StationHandler,), {"coordinator": coordinator})
+    try:
+        server = farmprotocol.create_server(address, handler)
+    except OSError as e:
+        parser.error(f"cannot listen on {address}: {e}")
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+    print(f"Coordinator listening on {address}, waiting for {stations} station(s).")
+
+    coordinator.wait()
+    server.shutdown()
+    server.server_close()
+
+    result_files = []
+    for station, result in coordinator.results().items():
+        result_files.append(watchdogtest.save_result(result, result_location, name=station))
+    program_time = time.perf_counter() - program_start
+    print(f"\nFarm run ended in {program_time:.4f} seconds.")
+    for result_file in result_files:
+        print(f"Results: {result_file}")
+    return result_files
+
+
+def main():
+    run(standalone=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import base64
+import fnmatch
+import io
+import json
+import os
+import socket
+import socketserver
+import tarfile
+
+DEFAULT_ADDRESS = "localhost:7600"
+# Seconds a station waits before asking again when no job is ready yet
+POLL_DELAY = 2
+# Files of a built target used by newt load, the rest of bin/targets/<target> stays on the coordinator
+LOAD_ARTIFACTS = ("*.img", "*.elf", "*.elf.bin", "*.hex", "manifest.json")
+
+# Messages are JSON objects, one per line, exchanged between the coordinator and station workers:
+#   station -> coordinator: hello, get_job, result
+#   coordinator -> station: welcome, job, wait, done, error
+
+
+def parse_address(address):
+    # "host:port" is a TCP address, anything else is a path of a Unix socket
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return socket.AF_INET, (host or "localhost", int(port))
+    return socket.AF_UNIX, address
+
+
+def connect(address):
+    family, addr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.connect(addr)
+    return sock
+
+
+class ReusableTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+def create_server(address, handler):
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.unlink(addr)
+        server = socketserver.ThreadingUnixStreamServer(addr, handler)
+    else:
+        server = ReusableTCPServer(addr, handler)
+    server.daemon_threads = True
+    return server
+
+
+def send_message(wfile, message):
+    wfile.write(json.dumps(message).encode('utf-8') + b"\n")
+    wfile.flush()
+
+
+def read_message(rfile):
+    line = rfile.readline()
+    if not line:
+        return None
+    return json.loads(line.decode('utf-8'))
+
+
+def load_artifact(tarinfo):
+    # Object files and archives are dropped, newt load only needs the images, the ELFs and the manifest
+    name = os.path.basename(tarinfo.name)
+    if tarinfo.isdir() or any(fnmatch.fnmatch(name, pattern) for pattern in LOAD_ARTIFACTS):
+        return tarinfo
+    return None
+
+
+def pack_directory(path, tar_filter=load_artifact):
+    # Built targets are shipped to stations as a base64 encoded tar.gz of their bin directory
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        tar.add(path, arcname=os.path.basename(os.path.normpath(path)), filter=tar_filter)
+    return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+
+def unpack_directory(data, destination):
+    buffer = io.BytesIO(base64.b64decode(data))
+    with tarfile.open(fileobj=buffer, mode="r:gz") as tar:
+        tar.extractall(destination, filter='data')
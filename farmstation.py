@@ -0,0 +1,212 @@
+import argparse
+import socket
+import sys
+import time
+
+import boardhealth
+import config
+import farmprotocol
+import hubcontrol
+import targetscripts
+import testcases
+import watchdogtest
+
+BIN_TARGETS_PATH = f"{config.TARGET_PATH}bin/targets/"
+
+
+def station_health_file(name):
+    # BoardHealth.save() rewrites the whole file, so stations sharing a host keep their own
+    return f"{config.PYTHON_PATH}jsons/board_health_{name}.json"
+
+
+class StationParser(argparse.ArgumentParser):
+    def __init__(self, standalone=False):
+        super().__init__(
+            description="Run tests distributed by the coordinator on boards attached to this station")
+        self.standalone = standalone
+        self.add_argument(
+            '-a', '--address',
+            type=str,
+            default=farmprotocol.DEFAULT_ADDRESS,
+            help=f"HOST:PORT or Unix socket path of the coordinator (default: {farmprotocol.DEFAULT_ADDRESS})",
+            metavar="ADDRESS",
+            dest='address')
+        self.add_argument(
+            '-n', '--name',
+            type=str,
+            default=socket.gethostname(),
+            help="name of the station (default: host name)",
+            metavar="NAME",
+            dest='name')
+        self.add_argument(
+            '-s', '--serial-number',
+            type=str,
+            help="specify serial number of the hub controller, overrides the one from the device map",
+            metavar="SERIAL",
+            dest='serial')
+        self.add_argument(
+            '-m', '--device-map',
+            type=str,
+            default=f"{config.PYTHON_PATH}jsons/",
+            help="directory containing device_map.json of this station",
+            metavar="DIR",
+            dest='device_map')
+        self.add_argument(
+            '-d', '--discovered',
+            action='store_true',
+            help="use device_map_discover.json instead of device_map.json",
+            dest='discovered')
+        self.add_argument(
+            '--dry-run',
+            action='store_true',
+            help="report every job without touching hubs or boards, for trying out a farm on one machine",
+            dest='dry_run')
+        self.add_argument(
+            '--health-file',
+            type=str,
+            help=f"board health file of this station (default: {station_health_file('NAME')})",
+            metavar="FILE",
+            dest='health_file')
+
+    def error(self, message):
+        if not self.standalone:
+            raise Exception(message)
+        self.print_usage(sys.stderr)
+        self.exit(2, f"Error: {message[0].upper() + message[1:] if message else ''}.\n")
+
+    def parse(self, arg_ns=None):
+        return self.parse_args(namespace=arg_ns)
+
+
+class Station:
+    def __init__(self, name, device_map, dry_run=False, health_file=None):
+        self.name = name
+        self.device_map = device_map
+        self.dry_run = dry_run
+        self.health = boardhealth.BoardHealth(health_file or station_health_file(name))
+        self.hub_controller = None
+
+    def prepare(self):
+        if self.dry_run:
+            return
+        self.hub_controller = hubcontrol.HubController()
+        self.hub_controller.serial = self.device_map["Hub serial"]
+        self.hub_controller.find_hub()
+        self.hub_controller.set_power('a', False)
+        time.sleep(watchdogtest.PORT_DELAY)
+
+    def install_images(self, job):
+        # Targets still have to exist locally for newt load, only building is skipped
+        board_name = job["Port"]["Name"]
+        for target_name, data in job["Build"].items():
+            if data is None:
+                return False
+            app_name = target_name[len(board_name) + 1:]
+            targetscripts.create_target(target_name)
+            targetscripts.set_target(target_name, board_name, app_name)
+            farmprotocol.unpack_directory(data, BIN_TARGETS_PATH)
+        return True
+
+    def run_job(self, job):
+        port = job["Port"]
+        print(f"\nJob {job['Id']}: {', '.join(job['Test cases'])} on port {port['Port']} ({port['Name']})")
+        if self.dry_run:
+            return {
+                "Port": port["Port"],
+                "Board name": port["Name"],
+                "Board serial": port["Serial_number"],
+                "Test passed": False,
+                "Stage": "dry_run",
+                "Test time [s]": 0.0,
+            }, None
+
+        build = "Build" not in job
+        if not build and not self.install_images(job):
+            return {
+                "Port": port["Port"],
+                "Board name": port["Name"],
+                "Board serial": port["Serial_number"],
+                "Test passed": False,
+                "Stage": boardhealth.STAGE_BUILD_FAILED,
+                "Test time [s]": 0.0,
+            }, None
+        return watchdogtest.test_port(self.hub_controller, port, self.health, build=build,
+                                      test_cases=testcases.get_test_cases(job["Test cases"]))
+
+    def serve(self, address):
+        with farmprotocol.connect(address) as sock:
+            rfile = sock.makefile('rb')
+            wfile = sock.makefile('wb')
+            farmprotocol.send_message(wfile, {
+                "type": "hello",
+                "station": self.name,
+                "device_map": self.device_map,
+            })
+            reply = farmprotocol.read_message(rfile)
+            if reply is None or reply["type"] != "welcome":
+                raise Exception(f"coordinator refused station {self.name}: {reply}")
+            print(f"Station {self.name} connected to {address}.")
+
+            jobs = 0
+            while True:
+                farmprotocol.send_message(wfile, {"type": "get_job"})
+                reply = farmprotocol.read_message(rfile)
+                if reply is None or reply["type"] == "done":
+                    break
+                if reply["type"] == "wait":
+                    time.sleep(reply.get("delay", farmprotocol.POLL_DELAY))
+                elif reply["type"] == "job":
+                    job = reply["job"]
+                    result, quarantined = self.run_job(job)
+                    farmprotocol.send_message(wfile, {
+                        "type": "result",
+                        "job_id": job["Id"],
+                        "result": result,
+                        "quarantined": quarantined,
+                    })
+                    jobs += 1
+                else:
+                    raise Exception(f"unexpected message from coordinator: {reply}")
+            return jobs
+
+
+def run(standalone=False, address=farmprotocol.DEFAULT_ADDRESS, name=None, h_serial=None,
+        device_map_location=f"{config.PYTHON_PATH}jsons/", discovered=False, dry_run=False, health_file=None):
+    program_start = time.perf_counter()
+    parser = StationParser(standalone=standalone)
+    if standalone:
+        args = parser.parse()
+        address = args.address
+        name = args.name
+        h_serial = args.serial
+        device_map_location = args.device_map
+        discovered = args.discovered
+        dry_run = args.dry_run
+        health_file = args.health_file
+    name = name or socket.gethostname()
+    if not device_map_location.endswith('/'):
+        device_map_location += '/'
+
+    try:
+        device_map = watchdogtest.load_device_map(device_map_location, discovered)
+    except FileNotFoundError as e:
+        parser.error(f"cannot read device map: {e}")
+    if h_serial:
+        device_map["Hub serial"] = h_serial
+
+    station = Station(name, device_map, dry_run=dry_run, health_file=health_file)
+    try:
+        station.prepare()
+        jobs = station.serve(address)
+    except Exception as e:
+        parser.error(str(e))
+    program_time = time.perf_counter() - program_start
+    print(f"\nStation {name} finished {jobs} jobs in {program_time:.4f} seconds.")
+
+
+def main():
+    run(standalone=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,8 @@ import argparse
 import hid
 import sys
 
+import metrics
+
 VENDOR_ID = 0xc0ca
 PRODUCT_ID = 0xc001
 
@@ -126,10 +128,11 @@ class HubController:
         if port == 'a' or port.isdigit() and 1 <= int(port) <= 8:
             path = self.hub['path']
             if path:
-                hub = hid.device()
-                hub.open_path(path)
-                feature_report = hub.get_feature_report(5, 9)
-                hub.close()
+                with metrics.timed("boardtests_hid_transaction_seconds", hub=self.serial, operation="get_state"):
+                    hub = hid.device()
+                    hub.open_path(path)
+                    feature_report = hub.get_feature_report(5, 9)
+                    hub.close()
                 if port == 'a':
                     for port in range(1, len(feature_report)):
                         port_state = feature_report[port]
@@ -179,10 +182,11 @@ class HubController:
         path = self.hub['path']
         cmd = bytes(self.port_set)
         if path:
-            hub = hid.device()
-            hub.open_path(path)
-            hub.send_feature_report(cmd)
-            hub.close()
+            with metrics.timed("boardtests_hid_transaction_seconds", hub=self.serial, operation="set_power"):
+                hub = hid.device()
+                hub.open_path(path)
+                hub.send_feature_report(cmd)
+                hub.close()
         else:
             self.parser.error("hub controller not found")
 
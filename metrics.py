@@ -0,0 +1,181 @@
+import contextlib
+import os
+import threading
+import time
+from pathlib import Path
+
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+# Enumeration is polled every watchdogtest.ENUMERATION_POLL seconds, finer buckets would be meaningless
+ENUMERATION_BUCKETS = (0.25, 0.5, 0.75, 1, 1.5, 2, 2.5, 3, 4, 5, 7.5, 10)
+
+METRICS = {
+    "boardtests_test_duration_seconds": ("histogram", "Duration of a board test", DURATION_BUCKETS),
+    "boardtests_build_duration_seconds": ("histogram", "Duration of newt build of a target", DURATION_BUCKETS),
+    "boardtests_load_duration_seconds": ("histogram", "Duration of newt load of a target", DURATION_BUCKETS),
+    "boardtests_enumeration_seconds": ("histogram", "Time from powering a port until its board enumerates",
+                                       ENUMERATION_BUCKETS),
+    "boardtests_hid_transaction_seconds": ("histogram", "Latency of a HID transaction with a hub controller",
+                                           FAST_BUCKETS),
+    "boardtests_tests": ("counter", "Board tests by result", None),
+}
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Recording is a no-op until enable() is called, so instrumented code costs one flag check when disabled
+enabled = False
+_lock = threading.Lock()
+_samples = {}
+_context = threading.local()
+_server = None
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with _lock:
+        _samples.clear()
+
+
+def _key(name, labels):
+    context = getattr(_context, "labels", None)
+    if context:
+        labels = {**context, **labels}
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+@contextlib.contextmanager
+def labels(**values):
+    # Labels applied to everything recorded by this thread inside the block, e.g. board, hub and port
+    previous = getattr(_context, "labels", None)
+    _context.labels = {**(previous or {}), **values}
+    try:
+        yield
+    finally:
+        _context.labels = previous
+
+
+def inc(name, value=1, **label_values):
+    if not enabled:
+        return
+    key = _key(name, label_values)
+    with _lock:
+        _samples[key] = _samples.get(key, 0) + value
+
+
+def observe(name, value, **label_values):
+    if not enabled:
+        return
+    key = _key(name, label_values)
+    buckets = METRICS[name][2]
+    with _lock:
+        histogram = _samples.get(key)
+        if histogram is None:
+            histogram = _samples[key] = [[0] * len(buckets), 0.0, 0]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[0][index] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+
+@contextlib.contextmanager
+def timed(name, **label_values):
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **label_values)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_pairs, extra=()):
+    pairs = list(label_pairs) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render(openmetrics=True):
+    with _lock:
+        samples = {key: (value if not isinstance(value, list) else [list(value[0]), value[1], value[2]])
+                   for key, value in _samples.items()}
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        series = sorted((key[1], value) for key, value in samples.items() if key[0] == name)
+        if not series:
+            continue
+        family = name if kind != "counter" or openmetrics else f"{name}_total"
+        lines.append(f"# HELP {family} {help_text}")
+        lines.append(f"# TYPE {family} {kind}")
+        for label_pairs, value in series:
+            if kind == "counter":
+                lines.append(f"{name}_total{_format_labels(label_pairs)} {value}")
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, bucket in zip(buckets, counts):
+                cumulative += bucket
+                lines.append(f"{name}_bucket{_format_labels(label_pairs, [('le', str(float(bound)))])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(label_pairs, [('le', '+Inf')])} {count}")
+            lines.append(f"{name}_sum{_format_labels(label_pairs)} {total}")
+            lines.append(f"{name}_count{_format_labels(label_pairs)} {count}")
+    if openmetrics:
+        lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(filename):
+    # node-exporter's textfile collector may read at any time, so replace the file atomically
+    output_file = Path(filename)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output_file.with_name(f".{output_file.name}.{os.getpid()}.tmp")
+    with open(tmp_file, "w") as f:
+        f.write(render(openmetrics=False))
+    os.replace(tmp_file, output_file)
+
+
+def start_http_server(port, address=""):
+    # The scheduler calls run() every day within one process, so the server is started only once
+    global _server
+    if _server is not None:
+        return _server
+    import http.server
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != "/metrics":
+                self.send_error(404)
+                return
+            openmetrics = "application/openmetrics-text" in self.headers.get("Accept", "")
+            body = render(openmetrics=openmetrics).encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", OPENMETRICS_CONTENT_TYPE if openmetrics else PROMETHEUS_CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    _server = http.server.ThreadingHTTPServer((address, port), MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"Metrics available at http://{address or 'localhost'}:{port}/metrics")
+    return _server
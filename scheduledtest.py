@@ -1,5 +1,6 @@
 import schedule
 import time
+import dashboard
 import sendmail
 import watchdogtest
 
@@ -9,6 +10,11 @@ def run_daily_test():
     result_file = watchdogtest.run(h_serial='2')
     print("Newest file by name: ", result_file)
     sendmail.send_email(result_file)
+    # A broken dashboard must not stop the scheduler, the result file and the email are already out
+    try:
+        dashboard.run(result_files=[result_file])
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Updating the dashboard failed: {e}")
 
 
 def main():
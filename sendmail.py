@@ -1,15 +1,45 @@
+import argparse
+import glob
 import json
 import smtplib
+import sys
 from email.message import EmailMessage
 import mimetypes
 import os
 import config
 
 
-def send_email(sent_file=None):
-    with open(sent_file, "r") as file:
-        results = json.load(file)
+class ReportParser(argparse.ArgumentParser):
+    def __init__(self, standalone=False):
+        super().__init__(
+            description="Send the email report of a test result file")
+        self.standalone = standalone
+        self.add_argument(
+            '-f', '--file',
+            type=str,
+            help="result file to report (default: newest watchdog_test_*.json)",
+            metavar="FILE",
+            dest='file')
+
+    def error(self, message):
+        if not self.standalone:
+            raise Exception(message)
+        self.print_usage(sys.stderr)
+        self.exit(2, f"Error: {message[0].upper() + message[1:] if message else ''}.\n")
+
+    def parse(self, arg_ns=None):
+        return self.parse_args(namespace=arg_ns)
+
+
+def newest_result(result_location=f"{config.PYTHON_PATH}jsons/"):
+    result_files = glob.glob(f"{result_location}watchdog_test_*.json")
+    if not result_files:
+        return None
+    return max(result_files, key=os.path.getmtime)
+
 
+def render_report_content(results, file_name):
+    # Tables of the report, shared by the email and the run pages of the dashboard
     rows = ""
     hub_serial = results["Hub serial"]
     for test in results["Watchdog tests"]:
@@ -17,6 +47,14 @@ def send_email(sent_file=None):
         board = test["Board name"]
         board_serial = test["Board serial"]
         status = test["Test passed"]
+        # Results written before test cases were introduced keep the interval at the top level
+        reset_time = test.get("Load to watchdog reset [s]")
+        reset_time = f"{reset_time:.3f}" if reset_time is not None else "-"
+        cases = ""
+        for case in test.get("Test cases", []):
+            if case.get("Load to watchdog reset [s]") is not None:
+                reset_time = f"{case['Load to watchdog reset [s]']:.3f}"
+            cases += f"{'✅' if case['Test passed'] else '❌'} {case['Test case']} "
         icon = "✅" if status is True else "❌"
         color = "green" if status is True else "red"
         rows += (f"<tr>"
@@ -24,12 +62,50 @@ def send_email(sent_file=None):
                  f"<td>{board}</td>"
                  f"<td>{board_serial}</td>"
                  f"<td style='color:{color};'>{icon} {status}</td>"
+                 f"<td>{test.get('Stage', '')}</td>"
+                 f"<td>{cases}</td>"
+                 f"<td>{reset_time}</td>"
                  f"</tr>")
 
-    html_body = f"""
-    <html>
-      <body>
-        <h2 style="color: steelblue;">Test Report</h2>
+    quarantined_rows = ""
+    for board in results.get("Quarantined boards", []):
+        quarantined_rows += (f"<tr>"
+                             f"<td>{board['Port']}</td>"
+                             f"<td>{board['Board name']}</td>"
+                             f"<td>{board['Board serial']}</td>"
+                             f"<td>{board['Quarantined since']}</td>"
+                             f"<td>{board['Last probe']}</td>"
+                             f"</tr>")
+    quarantined_table = ""
+    if quarantined_rows:
+        quarantined_table = f"""
+        <h3>Quarantined Boards</h3>
+        <table border="1" cellspacing="0" cellpadding="5" style="border-collapse: collapse;">
+          <caption>Boards skipped after repeated infrastructure failures</caption>
+          <tr>
+            <th>Port number</th>
+            <th>Board name</th>
+            <th>Board serial</th>
+            <th>Quarantined since</th>
+            <th>Last probe</th>
+          </tr>
+          {quarantined_rows}
+        </table>"""
+
+    unchanged = results.get("Unchanged boards", [])
+    unchanged_note = ""
+    if unchanged:
+        names = ", ".join(f"{board['Board name']} (port {board['Port']})" for board in unchanged)
+        unchanged_note = f"""
+        <p>Not tested, sources unchanged since the last passed test: {names}</p>"""
+
+    untested = results.get("Untested boards", [])
+    if untested:
+        names = ", ".join(f"{board['Name']} (port {board['Port']})" for board in untested)
+        unchanged_note += f"""
+        <p>Not tested, the station disconnected and did not come back: {names}</p>"""
+
+    return f"""
         <h3>Watchdog Tests</h3>
         <table border="1" cellspacing="0" cellpadding="5" style="border-collapse: collapse;">
           <caption>Watchdog tests for hub {hub_serial}</caption>
@@ -38,14 +114,31 @@ def send_email(sent_file=None):
             <th>Board name</th>
             <th>Board serial</th>
             <th>Test passed</th>
+            <th>Stage</th>
+            <th>Test cases</th>
+            <th>Load to watchdog reset [s]</th>
           </tr>
           {rows}
-        </table>
-        <p>{os.path.basename(sent_file)}</p>
+        </table>{quarantined_table}{unchanged_note}
+        <p>{file_name}</p>"""
+
+
+def render_report(results, file_name):
+    return f"""
+    <html>
+      <body>
+        <h2 style="color: steelblue;">Test Report</h2>{render_report_content(results, file_name)}
       </body>
     </html>
     """
 
+
+def send_email(sent_file=None):
+    with open(sent_file, "r") as file:
+        results = json.load(file)
+
+    html_body = render_report(results, os.path.basename(sent_file))
+
     # Compose the email
     msg = EmailMessage()
     msg["From"] = config.SENDER
@@ -90,8 +183,19 @@ def send_email(sent_file=None):
         print(f"Failed to send email: {e}")
 
 
+def run(standalone=False, result_file=None):
+    parser = ReportParser(standalone=standalone)
+    if standalone:
+        args = parser.parse()
+        result_file = args.file
+    result_file = result_file or newest_result()
+    if result_file is None or not os.path.isfile(result_file):
+        parser.error("no result file to report")
+    send_email(result_file)
+
+
 def main():
-    send_email()
+    run(standalone=True)
 
 
 if __name__ == "__main__":
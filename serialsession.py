@@ -0,0 +1,236 @@
+import argparse
+import cProfile
+import math
+import pstats
+import struct
+import sys
+import time
+
+import boardhealth
+import sessionfile
+import testcases
+import watchdogtest
+
+# Recorded stages which depend on the host rather than on the output, replay cannot reproduce them
+UNREPLAYABLE_STAGES = (boardhealth.STAGE_SERIAL_ERROR,)
+
+
+class ReplayParser(argparse.ArgumentParser):
+    def __init__(self, standalone=False):
+        super().__init__(
+            description="Replay recorded serial sessions through the reader and check the verdicts "
+                        "of the current test cases against the recorded ones")
+        self.standalone = standalone
+        self.add_argument(
+            'files',
+            nargs='*',
+            help=f"session files or directories of them (default: {sessionfile.SESSION_PATH})",
+            metavar="FILE")
+        self.add_argument(
+            '-r', '--realtime',
+            action='store_true',
+            help="replay at the original speed instead of as fast as possible",
+            dest='realtime')
+        self.add_argument(
+            '--speed',
+            type=float,
+            help="replay at the given multiple of the original speed, implies --realtime",
+            metavar="FACTOR",
+            dest='speed')
+        self.add_argument(
+            '-v', '--verbose',
+            action='store_true',
+            help="print the replayed output and the verdict of every test case",
+            dest='verbose')
+        self.add_argument(
+            '-p', '--profile',
+            action='store_true',
+            help="profile the reader and print the functions it spent the most time in",
+            dest='profile')
+
+    def error(self, message):
+        if not self.standalone:
+            raise Exception(message)
+        self.print_usage(sys.stderr)
+        self.exit(2, f"Error: {message[0].upper() + message[1:] if message else ''}.\n")
+
+    def parse(self, arg_ns=None):
+        return self.parse_args(namespace=arg_ns)
+
+
+class ReplaySerial:
+    # Stands in for serial.Serial: read() returns the recorded chunks and clock() their recorded timestamps,
+    # so the reader stamps lines as it did when they arrived. With a speed, chunks are held back until their
+    # time has come and reads time out like the port does; without one they are returned at once.
+    def __init__(self, chunks, speed=None, before_read=None, timeout=watchdogtest.READ_TIMEOUT):
+        self.chunks = chunks
+        self.speed = speed
+        self.before_read = before_read
+        self.timeout = timeout
+        self.index = 0
+        self.position = 0
+        self.now = 0.0
+        self.replay_start = time.perf_counter()
+        self.is_open = True
+
+    def clock(self):
+        return self.now
+
+    def due_in(self, stamp):
+        if not self.speed:
+            return 0.0
+        return stamp / self.speed - (time.perf_counter() - self.replay_start)
+
+    @property
+    def in_waiting(self):
+        if self.index >= len(self.chunks):
+            return 0
+        stamp, chunk = self.chunks[self.index]
+        return len(chunk) - self.position if self.due_in(stamp) <= 0 else 0
+
+    def read(self, size=1):
+        if self.index >= len(self.chunks):
+            if self.before_read is not None:
+                self.before_read(math.inf)
+            self.is_open = False
+            return b""
+        stamp, chunk = self.chunks[self.index]
+        wait = self.due_in(stamp)
+        if wait > 0:
+            time.sleep(min(wait, self.timeout))
+            if self.due_in(stamp) > 0:
+                return b""
+        if self.before_read is not None:
+            self.before_read(stamp)
+        self.now = stamp
+        data = chunk[self.position:self.position + size]
+        self.position += len(data)
+        if self.position >= len(chunk):
+            self.index += 1
+            self.position = 0
+        return data
+
+    def close(self):
+        self.is_open = False
+
+
+def replay_session(header, chunks, speed=None, echo=False):
+    # Runs the recorded output through watchdogtest.watchdog_search, arming every test case at its
+    # recorded time, and returns the stage the current test case definitions give each of them
+    arms = [(arm["Armed at [us]"] / 1e6, testcases.get_test_cases([arm["Test case"]])[0], arm)
+            for arm in header["Arms"]]
+    cases = []
+
+    def finish_case():
+        case = log.test_case
+        cases.append({
+            "Test case": case.name,
+            "Recorded stage": current["Stage"],
+            "Replayed stage": watchdogtest.verdict_stage(case, log),
+            **log.intervals(),
+        })
+
+    def arm_until(stamp):
+        while arms and arms[0][0] <= stamp:
+            armed_at, test_case, arm = arms.pop(0)
+            if log.test_case is not None:
+                finish_case()
+            current.update(arm)
+            log.arm(test_case, armed_at=armed_at)
+
+    current = {}
+    ser = ReplaySerial(chunks, speed=speed, before_read=arm_until)
+    log = watchdogtest.SerialLog(clock=ser.clock)
+    watchdogtest.stop_event.clear()
+    watchdogtest.watchdog_search(ser, log, keep_reading=True, echo=echo)
+    arm_until(math.inf)
+    if log.test_case is not None:
+        finish_case()
+    return cases, log
+
+
+def mismatches(cases):
+    return [case for case in cases if case["Recorded stage"] not in (None, *UNREPLAYABLE_STAGES) and
+            case["Recorded stage"] != case["Replayed stage"]]
+
+
+def run(standalone=False, files=(), speed=None, verbose=False, profile=False):
+    parser = ReplayParser(standalone=standalone)
+    if standalone:
+        args = parser.parse()
+        files = args.files
+        speed = args.speed or (1.0 if args.realtime else None)
+        verbose = args.verbose
+        profile = args.profile
+
+    files = sessionfile.session_files(files or [sessionfile.SESSION_PATH])
+    if not files:
+        parser.error("no session file to replay")
+
+    profiler = cProfile.Profile() if profile else None
+    replayed = 0
+    failed = []
+    skipped = []
+    total_bytes = 0
+    total_lines = 0
+    reader_time = 0.0
+    for session_file in files:
+        try:
+            header, chunks = sessionfile.load_session(session_file)
+        except (OSError, EOFError, ValueError, struct.error) as e:
+            print(f"Skipped {session_file}: {e}")
+            skipped.append(session_file)
+            continue
+        if verbose:
+            print(f"Replaying {session_file} ({header['Board name']} {header['Board serial']})")
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        try:
+            cases, log = replay_session(header, chunks, speed=speed, echo=verbose)
+        except Exception as e:
+            # E.g. a recorded test case which is no longer defined, the session fails the check
+            print(f"Skipped {session_file}: {e}")
+            skipped.append(session_file)
+            continue
+        finally:
+            if profiler:
+                profiler.disable()
+        reader_time += time.perf_counter() - start
+        replayed += 1
+        total_bytes += header["Bytes"]
+        total_lines += len(log.lines)
+
+        wrong = mismatches(cases)
+        if wrong:
+            failed.append(session_file)
+        for case in cases:
+            if verbose or case in wrong:
+                marker = "" if case not in wrong else "  <-- differs"
+                print(f"{session_file}: {case['Test case']} replayed {case['Replayed stage']}, "
+                      f"recorded {case['Recorded stage']}{marker}")
+
+    print(f"\nReplayed {replayed} session(s), {total_lines} lines, {total_bytes / 1e6:.2f} MB "
+          f"in {reader_time:.3f} s")
+    if reader_time > 0:
+        print(f"Reader throughput: {total_bytes / 1e6 / reader_time:.2f} MB/s, "
+              f"{total_lines / reader_time:.0f} lines/s")
+    if profiler:
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(15)
+    if failed:
+        print(f"{len(failed)} session(s) with verdicts differing from the recorded ones.")
+    if skipped:
+        print(f"{len(skipped)} session(s) could not be replayed.")
+    failed += skipped
+    if failed or not replayed:
+        if standalone:
+            sys.exit(1)
+    return failed
+
+
+def main():
+    run(standalone=True)
+
+
+if __name__ == "__main__":
+    main()
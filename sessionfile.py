@@ -0,0 +1,87 @@
+import datetime
+import gzip
+import json
+import os
+import struct
+from pathlib import Path
+
+import config
+
+# Session files hold the serial output of one board session, see serialsession for replaying them
+SESSION_PATH = f"{config.PYTHON_PATH}jsons/sessions/"
+SESSION_SUFFIX = ".session.gz"
+MAGIC = b"BOARDTESTS-SESSION 2\n"
+# Every chunk read from the port: microseconds since the session started and length, then the bytes
+CHUNK_HEADER = struct.Struct("<QI")
+# Chunk headers by format version, version 1 stored the offset in 32 bits which overflow after 71 minutes
+CHUNK_HEADERS = {
+    b"BOARDTESTS-SESSION 1\n": struct.Struct("<II"),
+    MAGIC: CHUNK_HEADER,
+}
+
+
+def offset(stamp, started_at):
+    return max(0, round((stamp - started_at) * 1e6))
+
+
+def save_session(log, board_name, board_serial, case_results, location=SESSION_PATH):
+    # Writes the chunks and arms of a watchdogtest.SerialLog with the stages the session ended in
+    now = datetime.datetime.now()
+    recorded = list(case_results)
+    arms = []
+    for armed_at, name in log.arms:
+        # Cases are armed in the order of their results, skipped ones (build or load failed) are not armed
+        result = next((r for r in recorded if r["Test case"] == name), None)
+        if result is not None:
+            recorded.remove(result)
+        arms.append({
+            "Test case": name,
+            "Armed at [us]": offset(armed_at, log.started_at),
+            "Stage": result["Stage"] if result is not None else None,
+        })
+    header = {
+        "Board name": board_name,
+        "Board serial": board_serial,
+        "Date": now.isoformat(timespec='seconds'),
+        "Arms": arms,
+        "Chunks": len(log.chunks),
+        "Bytes": sum(len(chunk) for _, chunk in log.chunks),
+    }
+
+    session_file = Path(location) / f"{board_serial}_{now.strftime('%Y-%m-%d_%H-%M-%S')}{SESSION_SUFFIX}"
+    session_file.parent.mkdir(parents=True, exist_ok=True)
+    with gzip.open(session_file, "wb") as f:
+        f.write(MAGIC)
+        f.write(json.dumps(header).encode('utf-8') + b"\n")
+        for stamp, chunk in log.chunks:
+            f.write(CHUNK_HEADER.pack(offset(stamp, log.started_at), len(chunk)))
+            f.write(chunk)
+    return str(session_file)
+
+
+def load_session(session_file):
+    # Returns the header and the chunks of a session as (seconds since its start, bytes)
+    with gzip.open(session_file, "rb") as f:
+        chunk_header = CHUNK_HEADERS.get(f.readline())
+        if chunk_header is None:
+            raise ValueError(f"{session_file} is not a session file")
+        header = json.loads(f.readline())
+        data = f.read()
+    chunks = []
+    position = 0
+    while position < len(data):
+        stamp, length = chunk_header.unpack_from(data, position)
+        position += chunk_header.size
+        chunks.append((stamp / 1e6, data[position:position + length]))
+        position += length
+    return header, chunks
+
+
+def session_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(str(p) for p in Path(path).glob(f"*{SESSION_SUFFIX}"))
+        else:
+            files.append(path)
+    return files
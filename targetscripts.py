@@ -2,6 +2,8 @@ import os
 
 import command
 import config
+import metrics
+import testcases
 
 # Path containing the Mynewt project
 # PROJECTS_DIR = config.BASE_PATH
@@ -34,14 +36,21 @@ def create_target(target_name, print_output=False):
     return success
 
 
-def set_target(target_name, board_name, app_name, print_output=False):
+def app_package(app_name):
     if app_name == "boot":
-        success, output = command.run_cmd(f"newt target set {target_name} app=@mcuboot/boot/mynewt")
-    else:
-        success, output = command.run_cmd(f"newt target set {target_name} app=apps/{app_name}")
+        return "@mcuboot/boot/mynewt"
+    return f"apps/{app_name}"
+
+
+def bsp_package(board_name):
+    return f"{BSP_DIR}{board_name}"
+
+
+def set_target(target_name, board_name, app_name, print_output=False):
+    success, output = command.run_cmd(f"newt target set {target_name} app={app_package(app_name)}")
     if not success or print_output:
         print(output)
-    success, output = command.run_cmd(f"newt target set {target_name} bsp={BSP_DIR}{board_name}")
+    success, output = command.run_cmd(f"newt target set {target_name} bsp={bsp_package(board_name)}")
     if not success or print_output:
         print(output)
     if app_name == "boot":
@@ -54,7 +63,8 @@ def set_target(target_name, board_name, app_name, print_output=False):
 
 def build_target(target_name, print_output=False):
     print(f"Building target: {target_name}")
-    success, output = command.run_cmd(f"newt build {target_name}")
+    with metrics.timed("boardtests_build_duration_seconds", target=target_name):
+        success, output = command.run_cmd(f"newt build {target_name}")
     if not success or print_output:
         print(output)
     return success
@@ -70,7 +80,8 @@ def create_image(target_name, print_output=False):
 
 def load_image(target_name, print_output=False):
     print(f"Loading target: {target_name}")
-    success, output = command.run_cmd(f"newt load {target_name}")
+    with metrics.timed("boardtests_load_duration_seconds", target=target_name):
+        success, output = command.run_cmd(f"newt load {target_name}")
     if not success or print_output:
         print(output)
     return success
@@ -79,9 +90,10 @@ def load_image(target_name, print_output=False):
 def full_create_target(target_name, board_name, app_name, print_output=False):
     create_target(target_name)
     set_target(target_name, board_name, app_name, print_output=print_output)
-    build_target(target_name, print_output=print_output)
-    if app_name != "boot":
-        create_image(target_name, print_output=print_output)
+    success = build_target(target_name, print_output=print_output)
+    if success and app_name != "boot":
+        success = create_image(target_name, print_output=print_output)
+    return success
 
 
 def main():
@@ -91,17 +103,10 @@ def main():
             board_name = entry.name
             print(f"\nProcessing target board: {board_name}")
 
-            app_name = "boot"
-            target_name = create_target_name(board_name, app_name)
-            full_create_target(target_name, board_name, app_name)
-
-            app_name = "blinky"
-            target_name = create_target_name(board_name, app_name)
-            full_create_target(target_name, board_name, app_name)
-
-            app_name = "watchdog"
-            target_name = create_target_name(board_name, app_name)
-            full_create_target(target_name, board_name, app_name)
+            app_names = ["boot", *(test_case.app for test_case in testcases.TEST_CASES.values())]
+            for app_name in dict.fromkeys(app_names):
+                target_name = create_target_name(board_name, app_name)
+                full_create_target(target_name, board_name, app_name)
 
             print(f"Done with {board_name}")
             print("-" * 40)
@@ -0,0 +1,61 @@
+VERDICT_PASS = "pass"
+VERDICT_FAIL = "fail"
+
+
+class TestCase:
+    # An app loaded on a board after the bootloader, judged by the lines it prints on the serial port.
+    # A case passes on the first line containing one of pass_patterns and fails on one of fail_patterns.
+    # When the timeout expires first, it passes only with pass_on_timeout (apps expected to run without
+    # a verdict line), and with require_output only if the app printed something after its load.
+    def __init__(self, name, app, pass_patterns=(), fail_patterns=(), timeout=60, pass_on_timeout=False,
+                 require_output=True, event="verdict"):
+        self.name = name
+        self.app = app
+        self.pass_patterns = tuple(pass_patterns)
+        self.fail_patterns = tuple(fail_patterns)
+        self.timeout = timeout
+        self.pass_on_timeout = pass_on_timeout
+        self.require_output = require_output
+        # Name of the awaited event in reported intervals, e.g. "Load to watchdog reset [s]"
+        self.event = event
+
+    def verdict(self, line):
+        if any(pattern in line for pattern in self.fail_patterns):
+            return VERDICT_FAIL
+        if any(pattern in line for pattern in self.pass_patterns):
+            return VERDICT_PASS
+        return None
+
+
+TEST_CASES = {}
+
+
+def register(test_case):
+    TEST_CASES[test_case.name] = test_case
+    return test_case
+
+
+def get_test_cases(names):
+    unknown = [name for name in names if name not in TEST_CASES]
+    if unknown:
+        raise Exception(f"unknown test case(s) {', '.join(unknown)}, available: {', '.join(TEST_CASES)}")
+    return [TEST_CASES[name] for name in names]
+
+
+def parse_names(text):
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+
+register(TestCase(
+    "blinky", "blinky",
+    fail_patterns=("Reset reason: Watchdog", "Assert @", "Unhandled interrupt"),
+    timeout=10,
+    pass_on_timeout=True,
+    # The stock blinky only toggles an LED and mcuboot is quiet, a dead board fails to load or enumerate
+    require_output=False))
+
+register(TestCase(
+    "watchdog", "watchdog",
+    pass_patterns=("Reset reason: Watchdog",),
+    timeout=60,
+    event="watchdog reset"))
@@ -7,13 +7,23 @@ import serial
 import serial.tools.list_ports
 import json
 
+import boardhealth
+import changeimpact
 import discoverboards
 import hubcontrol
+import metrics
+import sessionfile
 import targetscripts
+import testcases
 import config
 
 SERIAL_RATE = 115200
 PORT_DELAY = 3
+# Serial reads return at least this often [s], so the reader notices stop_event
+READ_TIMEOUT = 0.1
+# Interval between checks whether a powered board enumerated [s]
+ENUMERATION_POLL = 0.2
+DEFAULT_TEST_CASES = getattr(config, "TEST_CASES", ["watchdog"])
 
 done = threading.Event()
 stop_event = threading.Event()
@@ -35,6 +45,37 @@ class WatchdogParser(argparse.ArgumentParser):
             help="specify serial number of the hub controller discovery",
             metavar="SERIAL",
             dest='serial')
+        self.add_argument(
+            '-i', '--impact',
+            action='store_true',
+            help="test only boards whose BSP, MCU/HAL packages or apps changed since their last passed test,\n"
+                 f"with a full sweep every {changeimpact.FULL_SWEEP_DAYS} days",
+            dest='impact')
+        self.add_argument(
+            '-t', '--test-cases',
+            type=str,
+            help="comma separated test cases run on every board within one power-on "
+                 f"(default: {','.join(DEFAULT_TEST_CASES)}), available: {','.join(testcases.TEST_CASES)}",
+            metavar="CASES",
+            dest='test_cases')
+        self.add_argument(
+            '--metrics-file',
+            type=str,
+            help="write metrics to a node-exporter textfile (*.prom) at the end of the run",
+            metavar="FILE",
+            dest='metrics_file')
+        self.add_argument(
+            '--metrics-port',
+            type=int,
+            help="serve metrics over HTTP on the given port while testing",
+            metavar="PORT",
+            dest='metrics_port')
+        self.add_argument(
+            '--record',
+            action='store_true',
+            help=f"record the serial output of every board to a session file in {sessionfile.SESSION_PATH},\n"
+                 "to be replayed with the replay command",
+            dest='record')
 
     def error(self, message):
         if not self.standalone:
@@ -46,29 +87,175 @@ class WatchdogParser(argparse.ArgumentParser):
         return self.parse_args(namespace=arg_ns)
 
 
-def watchdog_search(ser):
+class SerialLog:
+    # Host timestamps (time.perf_counter, taken right after each read) of everything received from a board
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started_at = clock()
+        # (timestamp, bytes) of every read and (timestamp, test case name) of every arm, kept for recording
+        self.chunks = []
+        self.arms = []
+        self.lines = []
+        self.lock = threading.Lock()
+        self.test_case = None
+        self.armed_at = None
+        self.first_output_at = None
+        self.verdict = None
+        self.verdict_at = None
+
+    def arm(self, test_case, armed_at=None):
+        # Called when the app of test_case has been loaded, only output received after it counts for its verdict
+        with self.lock:
+            self.test_case = test_case
+            self.armed_at = self.clock() if armed_at is None else armed_at
+            self.arms.append((self.armed_at, test_case.name))
+            self.first_output_at = None
+            self.verdict = None
+            self.verdict_at = None
+
+    def add_line(self, started, ended, text):
+        self.lines.append((started, ended, text))
+        with self.lock:
+            if self.test_case is None or self.verdict is not None or started < self.armed_at:
+                return False
+            if self.first_output_at is None:
+                self.first_output_at = started
+            self.verdict = self.test_case.verdict(text)
+            if self.verdict is not None:
+                self.verdict_at = started
+        return True
+
+    def intervals(self):
+        def interval(start, end):
+            return end - start if start is not None and end is not None else None
+        event = self.test_case.event
+        return {
+            "Load to first output [s]": interval(self.armed_at, self.first_output_at),
+            f"First output to {event} [s]": interval(self.first_output_at, self.verdict_at),
+            f"Load to {event} [s]": interval(self.armed_at, self.verdict_at),
+        }
+
+
+def verdict_stage(test_case, log):
+    # Stage of the armed test_case once its verdict was found or its timeout expired, output received
+    # after the timeout does not count
+    def in_time(stamp):
+        return stamp is not None and stamp - log.armed_at <= test_case.timeout
+    verdict = log.verdict if in_time(log.verdict_at) else None
+    if verdict == testcases.VERDICT_PASS:
+        return boardhealth.STAGE_PASSED
+    if verdict == testcases.VERDICT_FAIL:
+        return boardhealth.STAGE_FAILED
+    if in_time(log.first_output_at):
+        return boardhealth.STAGE_PASSED if test_case.pass_on_timeout else boardhealth.STAGE_TIMEOUT
+    if test_case.pass_on_timeout and not test_case.require_output:
+        return boardhealth.STAGE_PASSED
+    return boardhealth.STAGE_NO_OUTPUT
+
+
+def watchdog_search(ser, log=None, keep_reading=False, echo=True):
+    # Reads the serial port until the armed test case reaches a verdict, or until stop_event with keep_reading.
+    # Reads are stamped with log.clock, which a replayed session replaces with its recorded timestamps.
+    if log is None:
+        log = SerialLog()
+        log.arm(testcases.TEST_CASES["watchdog"])
     if ser is None:
         print("Serial connection is not established.")
         stop_event.set()
+        return
+    pending = b""
+    line_start = None
     while not stop_event.is_set() and ser.is_open:
         try:
-            reading = ser.readline()
-            reading = reading.decode('utf-8', errors="ignore")
-            print("    " + reading, end='')
-            if "Reset reason: Watchdog" in reading:
-                done.set()
-                print(f"Watchdog found!")
-                break
+            chunk = ser.read(ser.in_waiting or 1)
+            stamp = log.clock()
         except serial.serialutil.SerialException:
             stop_event.set()
             print("Serial exception occurred. Reading from serial failed.")
+            break
+        if not chunk:
+            continue
+        log.chunks.append((stamp, chunk))
+        if line_start is None:
+            line_start = stamp
+        pending += chunk
+        while b"\n" in pending:
+            line, pending = pending.split(b"\n", 1)
+            reading = line.decode('utf-8', errors="ignore") + "\n"
+            started = line_start
+            line_start = stamp if pending else None
+            if echo:
+                print("    " + reading, end='')
+            if not log.add_line(started, stamp, reading):
+                continue
+            if log.verdict is not None:
+                done.set()
+                if echo:
+                    print(f"Test case {log.test_case.name}: {log.verdict} line found!")
+                if not keep_reading:
+                    return
+
+
+def board_enumerated(board_serial, timeout=PORT_DELAY):
+    # Cheap probe: wait for the board's serial number to show up without building or loading anything
+    deadline = time.time() + timeout
+    while True:
+        ports = serial.tools.list_ports.comports()
+        if any(port.serial_number == board_serial for port in ports):
+            return True
+        if time.time() >= deadline:
+            return False
+        time.sleep(ENUMERATION_POLL)
 
 
-def watchdog_test(board_name, board_serial):
+def case_result(test_case, stage, test_time=0.0, log=None):
+    result = {
+        "Test case": test_case.name,
+        "App": test_case.app,
+        "Test passed": stage == boardhealth.STAGE_PASSED,
+        "Stage": stage,
+        "Test time [s]": test_time,
+    }
+    if log is not None:
+        result.update(log.intervals())
+    return result
+
+
+def not_run_result(test_case, stage):
+    # Result of a case which never ran because the session failed before it, counted as a failure
+    metrics.inc("boardtests_tests", result="fail", stage=stage, test_case=test_case.name)
+    return case_result(test_case, stage)
+
+
+def run_test_case(test_case, log, reader):
+    # Waits for the verdict of test_case, whose app has just been loaded, and returns the stage it ended in
+    done.clear()
+    log.arm(test_case)
+    print(f"Test case {test_case.name} started.")
+    start_time = time.time()
+    while time.time() < start_time + test_case.timeout:
+        if not reader.is_alive() or done.wait(0.2):
+            break
+    if not done.is_set() and (stop_event.is_set() or not reader.is_alive()):
+        stage = boardhealth.STAGE_SERIAL_ERROR
+        print("Reading from serial stopped.")
+    else:
+        stage = verdict_stage(test_case, log)
+        if not done.is_set() and not test_case.pass_on_timeout:
+            print("Test case have reached timeout.")
+    print(f"Test case {test_case.name} {'passed' if stage == boardhealth.STAGE_PASSED else 'failed'}.")
+    return stage
+
+
+def board_session(board_name, board_serial, test_cases, build=True, record=False):
+    # Loads the bootloader once and runs test_cases back to back on the board within one power-on.
+    # Returns the stage of the session and a result for every test case.
+    # With record, the serial output is saved to a session file which serialsession can replay.
     ports = serial.tools.list_ports.comports()
     ser = None
     device_serial = None
     potential_device = None
+    log = SerialLog()
     for port in ports:
         if port.serial_number is not None:
             device_serial = port.serial_number
@@ -78,56 +265,173 @@ def watchdog_test(board_name, board_serial):
                 elif port.location.endswith(".0"):
                     potential_device = port
 
-    if potential_device is not None:
-        device_serial = potential_device.serial_number
-        ser = serial.Serial(potential_device.device, SERIAL_RATE)
-
     done.clear()
     stop_event.clear()
 
     print(f"Found device serial: {device_serial}")
     print(f"Target board serial: {board_serial}")
-    if potential_device is not None:
-        target_name = targetscripts.create_target_name(board_name, "boot")
-        targetscripts.full_create_target(target_name, board_name, "boot", print_output=False)
-        targetscripts.load_image(target_name, print_output=False)
-        target_name = targetscripts.create_target_name(board_name, "watchdog")
-        targetscripts.full_create_target(target_name, board_name, "watchdog", print_output=False)
-        targetscripts.load_image(target_name, print_output=False)
-        print("Watchdog test started.")
-        t = threading.Thread(target=watchdog_search, args=(ser, ), daemon=False)
-        t.start()
-        timeout = 60
-        start_time = time.time()
-        while time.time() < start_time + timeout:
-            if not t.is_alive() or done.is_set():
-                break
-            time.sleep(0.2)
-        if done.is_set():
-            stop_event.set()
-            print("Watchdog test passed.")
-        elif stop_event.is_set():
-            print("Watchdog test failed.")
-        elif not t.is_alive():
-            print("Thread no longer exists.\n"
-                  "Watchdog test failed.")
-        else:
-            stop_event.set()
-            print("Thread have reached timeout.\n"
-                  "Watchdog test failed.")
-    else:
+    if potential_device is None:
         print("Different serial numbers. Connection abandoned.")
+        stage = boardhealth.STAGE_NOT_ENUMERATED
+        return stage, [not_run_result(test_case, stage) for test_case in test_cases]
+
+    built = {}
+    if build:
+        for app_name in session_apps(test_cases):
+            target_name = targetscripts.create_target_name(board_name, app_name)
+            built[app_name] = targetscripts.full_create_target(target_name, board_name, app_name,
+                                                               print_output=False)
+            if not built[app_name]:
+                print(f"Build of {target_name} failed.")
+        if not built["boot"]:
+            stage = boardhealth.STAGE_BUILD_FAILED
+            return stage, [not_run_result(test_case, stage) for test_case in test_cases]
+
+    try:
+        ser = serial.Serial(potential_device.device, SERIAL_RATE, timeout=READ_TIMEOUT)
+    except serial.serialutil.SerialException as e:
+        print(f"Opening serial port failed: {e}")
+        stage = boardhealth.STAGE_SERIAL_ERROR
+        return stage, [not_run_result(test_case, stage) for test_case in test_cases]
+
+    # The reader runs during loading already, so output right after an app starts is stamped when it arrives
+    t = threading.Thread(target=watchdog_search, args=(ser, log, True), daemon=False)
+    t.start()
+    results = []
+    stage = boardhealth.STAGE_PASSED
+    try:
+        if not targetscripts.load_image(targetscripts.create_target_name(board_name, "boot"), print_output=False):
+            print("Load of bootloader failed.")
+            stage = boardhealth.STAGE_LOAD_FAILED
+        for test_case in test_cases:
+            if stage in boardhealth.INFRASTRUCTURE_STAGES:
+                # The board or its debugger stopped responding, the remaining cases would fail the same way
+                results.append(not_run_result(test_case, stage))
+                continue
+            case_start = time.perf_counter()
+            if build and not built[test_case.app]:
+                case_stage = boardhealth.STAGE_BUILD_FAILED
+                results.append(case_result(test_case, case_stage))
+            elif not targetscripts.load_image(targetscripts.create_target_name(board_name, test_case.app),
+                                              print_output=False):
+                print(f"Load of {test_case.app} failed.")
+                case_stage = boardhealth.STAGE_LOAD_FAILED
+                results.append(case_result(test_case, case_stage, time.perf_counter() - case_start))
+            else:
+                case_stage = run_test_case(test_case, log, t)
+                results.append(case_result(test_case, case_stage, time.perf_counter() - case_start, log))
+            metrics.inc("boardtests_tests", result="pass" if case_stage == boardhealth.STAGE_PASSED else "fail",
+                        stage=case_stage, test_case=test_case.name)
+            if stage == boardhealth.STAGE_PASSED or case_stage in boardhealth.INFRASTRUCTURE_STAGES:
+                stage = case_stage
+    finally:
+        stop_event.set()
+        t.join()
+        ser.close()
+
+    if record:
+        # Recording is optional, a full disk must not end the run
+        try:
+            session_file = sessionfile.save_session(log, board_name, board_serial, results)
+            print(f"Serial session recorded to {session_file}")
+        except OSError as e:
+            print(f"Recording the serial session failed: {e}")
+    return stage, results
 
-    return done.is_set()
 
+def session_apps(test_cases):
+    # Apps loaded in a session, in load order, the bootloader first
+    return list(dict.fromkeys(("boot", *(test_case.app for test_case in test_cases))))
 
-def watchdogs_hub(device_map_location=f"{config.PYTHON_PATH}jsons/", discovered=False):
+
+def load_device_map(device_map_location=f"{config.PYTHON_PATH}jsons/", discovered=False):
     if discovered:
         with open(f"{device_map_location}device_map_discover.json", "r") as f:
-            device_map = json.load(f)
-    else:
-        with open(f"{device_map_location}device_map.json", "r") as f:
-            device_map = json.load(f)
+            return json.load(f)
+    with open(f"{device_map_location}device_map.json", "r") as f:
+        return json.load(f)
+
+
+def settle_after_power_up(board_serial, power_up):
+    # Time to enumerate is measured only with metrics enabled, the port settles for PORT_DELAY either way
+    if metrics.enabled and board_enumerated(board_serial):
+        metrics.observe("boardtests_enumeration_seconds", time.perf_counter() - power_up)
+    time.sleep(max(0.0, PORT_DELAY - (time.perf_counter() - power_up)))
+
+
+def test_port(hub_controller, port, health, build=True, test_cases=None, record=False):
+    # Returns (test result, None) for a tested board or (None, quarantine entry) for a skipped one
+    if test_cases is None:
+        test_cases = testcases.get_test_cases(DEFAULT_TEST_CASES)
+    print(f"\nTesting port {port['Port']}")
+    board_name = port["Name"]
+    board_serial = port['Serial_number']
+    number = port["Port"]
+
+    with metrics.labels(board=board_name, hub=hub_controller.serial, port=number):
+        if health.is_quarantined(board_serial):
+            entry = health.board(board_serial, board_name)
+            enumerated = False
+            if health.probe_due(board_serial):
+                print(f"Probing quarantined board {board_name} ({board_serial})")
+                power_up = time.perf_counter()
+                hub_controller.set_power(number, True)
+                enumerated = board_enumerated(board_serial)
+                health.record_probe(board_serial, enumerated)
+                health.save()
+                if not enumerated:
+                    hub_controller.set_power(number, False)
+                    time.sleep(PORT_DELAY)
+            if not enumerated:
+                print(f"Board {board_name} ({board_serial}) is quarantined, test skipped.")
+                metrics.inc("boardtests_tests", result="quarantined")
+                return None, {
+                    "Port": number,
+                    "Board name": board_name,
+                    "Board serial": board_serial,
+                    "Quarantined since": entry["Quarantined since"],
+                    "Last probe": entry["Last probe"],
+                }
+        else:
+            power_up = time.perf_counter()
+            hub_controller.set_power(number, True)
+        settle_after_power_up(board_serial, power_up)
+
+        test_start = time.perf_counter()
+        stage, case_results = board_session(board_name, board_serial, test_cases, build=build, record=record)
+        test_pass = stage == boardhealth.STAGE_PASSED
+        test_end = time.perf_counter()
+        test_time = (test_end - test_start)
+        print(f"Test time: {test_time:.4} seconds.")
+        metrics.observe("boardtests_test_duration_seconds", test_time)
+        health.record(board_serial, board_name, stage)
+        health.save()
+        hub_controller.set_power(number, False)
+        time.sleep(PORT_DELAY)
+    return {
+        "Port": number,
+        "Board name": board_name,
+        "Board serial": board_serial,
+        "Test passed": test_pass,
+        "Stage": stage,
+        "Test time [s]": test_time,
+        "Test cases": case_results,
+    }, None
+
+
+def save_result(watchdog_test_result, device_map_location=f"{config.PYTHON_PATH}jsons/", name=None):
+    now = (datetime.datetime.now())
+    prefix = f"watchdog_test_{name}" if name else "watchdog_test"
+    result_file = f"{device_map_location}{prefix}_{now.strftime('%Y-%m-%d_%H-%M')}.json"
+    with open(result_file, "w") as f:
+        json.dump(watchdog_test_result, f, indent=2)
+    return result_file
+
+
+def watchdogs_hub(device_map_location=f"{config.PYTHON_PATH}jsons/", discovered=False,
+                  health_file=boardhealth.HEALTH_FILE, impact=False, impact_file=changeimpact.IMPACT_FILE,
+                  test_cases=None, record=False):
+    device_map = load_device_map(device_map_location, discovered)
     ports = device_map["Ports"]
     hub_serial = device_map["Hub serial"]
     hub_controller = hubcontrol.HubController()
@@ -136,43 +440,42 @@ def watchdogs_hub(device_map_location=f"{config.PYTHON_PATH}jsons/", discovered=
     hub_controller.set_power('a', False)
     time.sleep(PORT_DELAY)
 
+    health = boardhealth.BoardHealth(health_file)
+    if test_cases is None:
+        test_cases = testcases.get_test_cases(DEFAULT_TEST_CASES)
+    board_unchanged = []
+    impact_state = None
+    if impact:
+        impact_state = changeimpact.ImpactState(session_apps(test_cases), impact_file)
+        ports, board_unchanged = impact_state.select(ports)
+
     print(f"Testing hub {hub_serial}")
     board_pass = []
+    board_quarantined = []
     for port in ports:
-        print(f"\nTesting port {port['Port']}")
-        board_name = port["Name"]
-        board_serial = port['Serial_number']
-        number = port["Port"]
-        hub_controller.set_power(number, True)
-        time.sleep(PORT_DELAY)
-
-        test_start = time.perf_counter()
-        test_pass = watchdog_test(board_name, board_serial)
-        test_end = time.perf_counter()
-        test_time = (test_end - test_start)
-        board_pass.append({
-            "Port": number,
-            "Board name": board_name,
-            "Board serial": board_serial,
-            "Test passed": test_pass,
-            "Test time [s]": test_time,
-        })
-        print(f"Test time: {test_time:.4} seconds.")
-        hub_controller.set_power(number, False)
-        time.sleep(PORT_DELAY)
+        result, quarantined = test_port(hub_controller, port, health, test_cases=test_cases, record=record)
+        if result is not None:
+            board_pass.append(result)
+            if impact_state is not None:
+                impact_state.record(result["Board name"], result["Board serial"], result["Test passed"])
+                impact_state.save()
+        else:
+            board_quarantined.append(quarantined)
+    if impact_state is not None:
+        impact_state.finish()
 
     watchdog_test_result = {
         "Hub serial": hub_serial,
-        "Watchdog tests": board_pass
+        "Watchdog tests": board_pass,
+        "Quarantined boards": board_quarantined,
+        "Unchanged boards": board_unchanged,
     }
-    now = (datetime.datetime.now())
-    result_file = f"{device_map_location}watchdog_test_{now.strftime('%Y-%m-%d_%H-%M')}.json"
-    with open(result_file, "w") as f:
-        json.dump(watchdog_test_result, f, indent=2)
-    return result_file
+    return save_result(watchdog_test_result, device_map_location)
 
 
-def run(standalone=False, h_serial=None):
+def run(standalone=False, h_serial=None, metrics_file=getattr(config, "METRICS_FILE", None),
+        metrics_port=getattr(config, "METRICS_PORT", None), impact=getattr(config, "IMPACT_SELECTION", False),
+        test_case_names=DEFAULT_TEST_CASES, record=getattr(config, "RECORD_SESSIONS", False)):
     program_start = time.perf_counter()
     print("Watchdog tests for hub started.\n")
     parser = WatchdogParser(standalone=standalone)
@@ -180,17 +483,37 @@ def run(standalone=False, h_serial=None):
         args = parser.parse()
         hub_serial = args.serial
         discovered = args.discover
+        metrics_file = args.metrics_file or metrics_file
+        metrics_port = args.metrics_port or metrics_port
+        impact = args.impact or impact
+        record = args.record or record
+        if args.test_cases:
+            test_case_names = testcases.parse_names(args.test_cases)
     else:
         hub_serial = h_serial
         discovered = False
 
+    try:
+        test_cases = testcases.get_test_cases(test_case_names)
+    except Exception as e:
+        parser.error(str(e))
+
+    if metrics_file or metrics_port:
+        metrics.enable()
+    if metrics_port:
+        try:
+            metrics.start_http_server(metrics_port)
+        except OSError as e:
+            parser.error(f"cannot serve metrics on port {metrics_port}: {e}")
+
     if discovered:
         try:
             discoverboards.run(h_serial=hub_serial)
         except Exception as e:
             parser.error(str(e))
     program_discover = time.perf_counter()
-    result_file = watchdogs_hub(discovered=discovered)
+    result_file = watchdogs_hub(discovered=discovered, impact=impact, test_cases=test_cases,
+                                record=record)
     program_end = time.perf_counter()
 
     print("\nWatchdog tests for hub ended.")
@@ -202,6 +525,9 @@ def run(standalone=False, h_serial=None):
     program_time = program_end - program_start
     print(f"Program time:  {program_time:.4f} seconds")
 
+    if metrics_file:
+        metrics.write_textfile(metrics_file)
+        print(f"Metrics written to {metrics_file}")
     return result_file
 
 